@@ -1,4 +1,3 @@
-from elasticsearch import Elasticsearch, RequestsHttpConnection, helpers
 import argparse
 import json
 import sys
@@ -24,9 +23,10 @@ def form_parser() -> argparse.ArgumentParser:
     return parser
 
 
-if __name__ == "__main__":
+def connect(args):
+    # the client is only imported once arguments are valid
+    from elasticsearch import Elasticsearch, RequestsHttpConnection
     es=None
-    args = form_parser().parse_args()
     if args.aws:
         if not(args.aws and args.aws_region and args.host):
             print("Error:AWS region and AWS elasticsearch host needed with AWS flag")
@@ -44,4 +44,11 @@ if __name__ == "__main__":
         es = Elasticsearch(args.host,timeout=30, max_retries=10, retry_on_timeout=True)
     else:
         es = Elasticsearch(timeout=30, max_retries=10, retry_on_timeout=True)
+    return es
+
+
+if __name__ == "__main__":
+    args = form_parser().parse_args()
+    es = connect(args)
+    from elasticsearch import helpers
     print(helpers.bulk(es, form_query(args.index,es)))
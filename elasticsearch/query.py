@@ -1,8 +1,12 @@
+from __future__ import annotations
 import argparse
 import sys
-from elasticsearch import Elasticsearch, RequestsHttpConnection
-from elasticsearch_dsl import Search
 import json
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    # elasticsearch is only imported when a client is created
+    import asyncio
+    from elasticsearch import AsyncElasticsearch, Elasticsearch
 
 #query elasticsearch
 def query(es:Elasticsearch, index:str, doctype:str,str_q:str):
@@ -25,6 +29,7 @@ def query(es:Elasticsearch, index:str, doctype:str,str_q:str):
     :type str_q:str
     :return: generator
     """
+    from elasticsearch_dsl import Search
     # TODO: Query string is never empty due to doc requirement
     if str_q=="":
         s = Search(using=es, index=index)
@@ -35,11 +40,14 @@ def query(es:Elasticsearch, index:str, doctype:str,str_q:str):
         yield hit.to_dict()
 
 
+def with_doctype(str_q:str, doctype:str) -> str:
+    if str_q=="":
+        return "type:"+doctype
+    return str_q+" AND type:"+doctype
+
+
 def run_query(args,es):
-    if args.query=="":
-        args.query="type:"+args.doctype
-    else:
-        args.query=args.query+" AND type:"+args.doctype
+    args.query=with_doctype(args.query,args.doctype)
     # TODO: Change scan to something else for cases where args.numlines is not -1
     if args.numlines!=-1:
         for i,x in enumerate(query(es,args.index,args.doctype,args.query)):
@@ -50,6 +58,88 @@ def run_query(args,es):
         for x in query(es,args.index,args.doctype,args.query):
             print(json.dumps(x))
 
+# Asynchronous fan-out: the index argument may list several indices and
+# index patterns. Patterns are resolved to concrete indices and every index
+# is scanned in its own task over one pooled AsyncElasticsearch client, at
+# most --concurrency scans at a time. Hits are written as they arrive, so
+# the output interleaves indices and the run takes about as long as the
+# slowest index rather than the sum of them.
+
+async def resolve_indices(es:AsyncElasticsearch, index:str) -> list:
+    """
+    Expands a comma separated list of indices and index patterns to the
+    concrete indices it matches.
+
+    :param es: AsyncElasticsearch Client
+    :type es: AsyncElasticsearch
+    :param index: indices and/or index patterns, i.e. batch1,batch2 or batch*
+    :type index:str
+    :return: sorted list of index names
+    """
+    found=await es.indices.get(index=index)
+    return sorted(found)
+
+
+async def scan_index(es:AsyncElasticsearch, index:str, str_q:str, limit:asyncio.Semaphore, args, emitted:list):
+    """
+    Scans one index and writes its hits to stdout as jsonl. Stops once
+    args.numlines hits have been written across all indices.
+
+    :param es: AsyncElasticsearch Client
+    :type es: AsyncElasticsearch
+    :param index: Elasticsearch index to be searched
+    :type index:str
+    :param str_q: Elasticsearch query string
+    :type str_q:str
+    :param limit: bounds the number of concurrent scans
+    :type limit:asyncio.Semaphore
+    :param args: runtime variables from argparse
+    :type args: argparse.Namespace
+    :param emitted: single element list counting the hits written
+    :type emitted:list
+    """
+    from elasticsearch.helpers import async_scan
+    async with limit:
+        if args.numlines!=-1 and emitted[0]>=args.numlines:
+            return
+        hits=async_scan(es, index=index, query={"query": {"query_string": {"query": str_q}}})
+        try:
+            async for hit in hits:
+                # other scans may have reached the limit while this one waited
+                if args.numlines!=-1 and emitted[0]>=args.numlines:
+                    break
+                doc=hit["_source"]
+                if args.tag_index:
+                    doc[args.tag_index]=hit["_index"]
+                print(json.dumps(doc))
+                emitted[0]+=1
+        finally:
+            # clears the scroll when the scan stops early
+            await hits.aclose()
+
+
+async def run_query_async(args):
+    import asyncio
+    from elasticsearch import NotFoundError
+    es=connect_async(args)
+    try:
+        try:
+            indices=await resolve_indices(es,args.index)
+        except NotFoundError:
+            # an index named without a wildcard does not exist
+            print("Error: index not found in "+args.index)
+            sys.exit(1)
+        if len(indices)==0:
+            print("Error: no indices match "+args.index)
+            sys.exit(1)
+        limit=asyncio.Semaphore(args.concurrency)
+        emitted=[0]
+        str_q=with_doctype(args.query,args.doctype)
+        await asyncio.gather(*[scan_index(es,x,str_q,limit,args,emitted) for x in indices])
+    finally:
+        await es.close()
+
+
 def get_mapping(d):
     """
     Reports fields and types of a dictionary recursively
@@ -81,15 +171,20 @@ def form_parser() -> argparse.ArgumentParser:
     parser.add_argument("-a","--aws",help="Using Amazon Web Services: requires boto3",action="store_true")
     parser.add_argument("-r","--aws_region",help="AWS region of Elasticsearch instance",default="us-east-2")
     parser.add_argument("-n","--numlines",help="Number of result lines returned: default is all",type=int,default=-1)
+    parser.add_argument("-s","--async",dest="use_async",action="store_true",
+                        help="Scan every index matched by index concurrently, index may be a comma separated list of indices and index patterns")
+    parser.add_argument("-c","--concurrency",help="Number of indices scanned at once with --async: default is 8",type=int,default=8)
+    parser.add_argument("-t","--tag_index",metavar="FIELD",default=None,
+                        help="With --async, add the index each hit came from to it under FIELD")
     parser.add_argument("index",help="Elasticsearch index to query.")
     parser.add_argument("doctype",help="Elasticsearch doc type to query.")
     parser.add_argument("query", type=str,help="Elasticsearch query string to query index.")
     return parser
 
 
-if __name__ == "__main__":
-    # parse args and open elasticsearch client
-    args = form_parser().parse_args()
+def connect(args) -> Elasticsearch:
+    # the clients are only imported once arguments are valid
+    from elasticsearch import Elasticsearch, RequestsHttpConnection
     client=None
     if args.aws:
         if not(args.aws and args.aws_region and args.host):
@@ -108,4 +203,29 @@ if __name__ == "__main__":
         client = Elasticsearch(args.host,timeout=30, max_retries=10, retry_on_timeout=True)
     else:
         client = Elasticsearch(timeout=30, max_retries=10, retry_on_timeout=True)
-    run_query(args,client)
+    return client
+
+
+def connect_async(args) -> AsyncElasticsearch:
+    # requires aiohttp, the pool holds one connection per concurrent scan
+    from elasticsearch import AsyncElasticsearch
+    if args.aws:
+        print("Error: --async does not support AWS Elasticsearch instances")
+        sys.exit(1)
+    if args.host:
+        return AsyncElasticsearch(args.host,timeout=30, max_retries=10, retry_on_timeout=True, maxsize=args.concurrency)
+    return AsyncElasticsearch(timeout=30, max_retries=10, retry_on_timeout=True, maxsize=args.concurrency)
+
+
+if __name__ == "__main__":
+    # parse args and open elasticsearch client
+    args = form_parser().parse_args()
+    if args.concurrency<1:
+        print("Error: --concurrency must be at least 1")
+        sys.exit(1)
+    if args.use_async:
+        from asyncio import run
+        run(run_query_async(args))
+    else:
+        client = connect(args)
+        run_query(args,client)
@@ -0,0 +1,178 @@
+""" Generates synthetic atomized VCF data for benchmarking mucor3.
+
+Records look like flattened vcf_atomizer output: one json object per
+sample, variant and snpEff annotation, with FORMAT fields under FMT.*
+and INFO fields under INFO.*. Variants are drawn from a shared cohort
+pool so they recur across samples, multi-allelic sites are expanded to
+one record per alternate allele and every record is repeated once per
+ANN transcript. Output is written per sample in genomic order, as if
+per-sample files had been concatenated.
+"""
+import argparse
+import json
+import random
+import sys
+
+CHROMS = ["chr" + str(x) for x in range(1, 23)] + ["chrX", "chrY"]
+BASES = "ACGT"
+EFFECTS = ["missense_variant", "synonymous_variant", "stop_gained", "frameshift_variant",
+           "intron_variant", "5_prime_UTR_variant", "3_prime_UTR_variant",
+           "upstream_gene_variant", "downstream_gene_variant", "splice_region_variant"]
+IMPACTS = ["HIGH", "MODERATE", "LOW", "MODIFIER"]
+AMINO = ["Ala", "Arg", "Asn", "Asp", "Cys", "Gln", "Glu", "Gly", "His", "Ile",
+         "Leu", "Lys", "Met", "Phe", "Pro", "Ser", "Thr", "Trp", "Tyr", "Val"]
+# list valued FORMAT fields in the order they are added
+LIST_FIELDS = ["AD", "F1R2", "F2R1", "SB", "PL", "AF_BY_READ"]
+
+# preset fixtures, from quick smoke runs to cohort sized inputs
+PRESETS = {
+    "tiny": dict(samples=4, variants=200),
+    "small": dict(samples=20, variants=2000),
+    "medium": dict(samples=100, variants=10000),
+    "large": dict(samples=500, variants=20000),
+}
+
+
+def make_allele(rng: random.Random, ref: str) -> str:
+    alt = rng.choice([x for x in BASES if x != ref[0]])
+    kind = rng.random()
+    if kind < 0.1:
+        # insertion
+        return ref[0] + "".join(rng.choice(BASES) for _ in range(rng.randint(1, 6)))
+    if kind < 0.2 and len(ref) > 1:
+        # deletion
+        return ref[0]
+    return alt
+
+
+def make_site(rng: random.Random, multiallelic_rate: float):
+    chrom = rng.choice(CHROMS)
+    pos = rng.randint(1, 50000000)
+    ref = rng.choice(BASES)
+    if rng.random() < 0.1:
+        ref += "".join(rng.choice(BASES) for _ in range(rng.randint(1, 5)))
+    alts = [make_allele(rng, ref)]
+    if rng.random() < multiallelic_rate:
+        second = make_allele(rng, ref)
+        if second != alts[0]:
+            alts.append(second)
+    return (chrom, pos, ref, alts)
+
+
+def make_annotations(rng: random.Random, alt: str, ann_factor: float):
+    # number of transcripts averages ann_factor
+    n = max(1, int(round(rng.uniform(1, 2 * ann_factor - 1))))
+    gene = "GENE" + str(rng.randint(1, 20000))
+    anns = []
+    for i in range(n):
+        effect = rng.choice(EFFECTS)
+        coding = effect in ("missense_variant", "synonymous_variant", "stop_gained", "frameshift_variant")
+        pos = rng.randint(1, 2000)
+        anns.append({
+            "INFO.ANN.allele": alt,
+            "INFO.ANN.effect": effect,
+            "INFO.ANN.impact": rng.choice(IMPACTS),
+            "INFO.ANN.gene_name": gene,
+            "INFO.ANN.gene_id": gene.replace("GENE", "ENSG"),
+            "INFO.ANN.feature_type": "transcript",
+            "INFO.ANN.feature_id": "ENST" + str(rng.randint(1, 10**9)).zfill(11) + "." + str(i + 1),
+            "INFO.ANN.transcript_biotype": "protein_coding",
+            "INFO.ANN.hgvs_c": "c." + str(pos) + "A>" + alt[0],
+            "INFO.ANN.hgvs_p": ("p." + rng.choice(AMINO) + str(pos // 3 + 1) + rng.choice(AMINO)) if coding else None,
+        })
+    return anns
+
+
+def generate(out, samples: int, variants: int, multiallelic_rate: float = 0.05,
+             ann_factor: float = 3.0, list_fields: int = 2, pool_factor: float = 4.0, seed: int = 0):
+    """
+    Writes synthetic atomized records to out.
+
+    :param out: text file object
+    :param samples: number of samples
+    :type samples: int
+    :param variants: number of variant sites per sample
+    :type variants: int
+    :param multiallelic_rate: fraction of sites with two alternate alleles
+    :type multiallelic_rate: float
+    :param ann_factor: average number of ANN transcripts per record
+    :type ann_factor: float
+    :param list_fields: number of list valued FORMAT fields
+    :type list_fields: int
+    :param pool_factor: size of the cohort variant pool relative to variants
+    :type pool_factor: float
+    :param seed: random seed
+    :type seed: int
+    :return: number of records written
+    """
+    rng = random.Random(seed)
+    pool = [make_site(rng, multiallelic_rate) for _ in range(max(variants, int(variants * pool_factor)))]
+    annotations = dict()
+    order = {x: i for i, x in enumerate(CHROMS)}
+    count = 0
+    for s in range(samples):
+        sample = "SAMPLE" + str(s + 1).zfill(5)
+        sites = sorted(rng.sample(pool, variants), key=lambda x: (order[x[0]], x[1]))
+        for chrom, pos, ref, alts in sites:
+            depth = rng.randint(10, 1000)
+            afs = [round(rng.uniform(0.01, 1.0), 3) for _ in alts]
+            alt_depths = [int(depth * af) for af in afs]
+            for i, alt in enumerate(alts):
+                key = (chrom, pos, ref, alt)
+                if key not in annotations:
+                    annotations[key] = make_annotations(rng, alt, ann_factor)
+                record = {
+                    "CHROM": chrom, "POS": pos, "ID": None, "REF": ref, "ALT": alt,
+                    "QUAL": round(rng.uniform(10, 3000), 2), "FILTER": "PASS",
+                    "sample": sample,
+                    "FMT.GT": "0/1",
+                    "FMT.AF": afs[i],
+                    "FMT.DP": depth,
+                    "INFO.DP": depth + rng.randint(0, 50),
+                    "Ref_Depth": depth - sum(alt_depths),
+                    "Alt_depths": alt_depths,
+                }
+                for name in LIST_FIELDS[:list_fields]:
+                    record["FMT." + name] = [rng.randint(0, depth) for _ in range(len(alts) + 1)]
+                for ann in annotations[key]:
+                    row = dict(record)
+                    row.update(ann)
+                    out.write(json.dumps(row) + "\n")
+                    count += 1
+    return count
+
+
+def form_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Generate synthetic atomized VCF jsonl")
+    parser.add_argument("-p", "--preset", choices=sorted(PRESETS), default=None,
+                        help="preset sample and variant counts")
+    parser.add_argument("-s", "--samples", type=int, default=10)
+    parser.add_argument("-v", "--variants", type=int, default=1000, help="variant sites per sample")
+    parser.add_argument("-m", "--multiallelic-rate", type=float, default=0.05)
+    parser.add_argument("-a", "--ann-factor", type=float, default=3.0,
+                        help="average number of ANN transcripts per record")
+    parser.add_argument("-l", "--list-fields", type=int, default=2,
+                        help="number of list valued FORMAT fields (max {})".format(len(LIST_FIELDS)))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default=None, help="output jsonl, defaults to stdout")
+    return parser
+
+
+def params_from_args(args) -> dict:
+    params = dict(samples=args.samples, variants=args.variants,
+                  multiallelic_rate=args.multiallelic_rate, ann_factor=args.ann_factor,
+                  list_fields=args.list_fields, seed=args.seed)
+    if args.preset is not None:
+        params.update(PRESETS[args.preset])
+    return params
+
+
+if __name__ == "__main__":
+    args = form_parser().parse_args()
+    params = params_from_args(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            n = generate(f, **params)
+    else:
+        n = generate(sys.stdout, **params)
+    print("wrote {} records".format(n), file=sys.stderr)
@@ -0,0 +1,368 @@
+""" Benchmarks for mucor3.
+
+Each benchmark case runs in a fresh python process so its peak memory is
+not inflated by earlier cases. Wall time, cpu time and peak RSS of the
+timed call are appended to a json history file together with the mucor3
+version and the generator parameters, so runs on different versions can
+be compared. With --fail-above a case that is slower than the previous
+run with the same parameters by more than the given ratio fails the run.
+
+    python benchmarks/run.py --preset small
+    python benchmarks/run.py --preset small --cases merge_rows aggregate_pivot --fail-above 1.25
+"""
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.dirname(BENCH_DIR)
+REPO_DIR = os.path.dirname(PYTHON_DIR)
+ES_DIR = os.path.join(REPO_DIR, "elasticsearch")
+sys.path.insert(0, PYTHON_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import generate
+
+VARIANT_FIELDS = ["CHROM", "POS", "REF", "ALT"]
+REQUIRED_FIELDS = ["sample"] + VARIANT_FIELDS
+DEFAULT_HISTORY = os.path.join(BENCH_DIR, "history.json")
+
+
+class Skip(Exception):
+    pass
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss /= 1024
+    return rss / 1024
+
+
+def load_file_module(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def read_master(data: str):
+    import pandas as pd
+    return pd.read_json(data, orient="records", lines=True)
+
+
+def sorted_master(data: str):
+    master = read_master(data)
+    master.set_index(REQUIRED_FIELDS, inplace=True)
+    master.sort_index(inplace=True)
+    master.reset_index(inplace=True)
+    return master
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# Every case takes the data file and a scratch directory and returns the
+# function to time and the number of input rows. Setup is not timed.
+
+def case_mucor_main(data: str, scratch: str, merge: bool = False):
+    import mucor.mucor as mucor
+    argv = ["mucor3", data, os.path.join(scratch, "out")] + (["-m"] if merge else [])
+
+    def run():
+        sys.argv = argv
+        with quiet():
+            mucor.main()
+    return run, None
+
+
+def case_mucor_main_merge(data: str, scratch: str):
+    return case_mucor_main(data, scratch, True)
+
+
+def case_merge_rows(data: str, scratch: str):
+    import mucor.merge as merge
+    master = sorted_master(data)
+    return (lambda: merge.merge_rows(master, REQUIRED_FIELDS)), len(master)
+
+
+def case_merge_rows_unique(data: str, scratch: str):
+    import mucor.merge as merge
+    master = sorted_master(data)
+    return (lambda: merge.merge_rows_unique(master, REQUIRED_FIELDS)), len(master)
+
+
+def case_aggregate_pivot(data: str, scratch: str):
+    import mucor.aggregate as aggregate
+    master = sorted_master(data)
+    return (lambda: aggregate.pivot(master, VARIANT_FIELDS, ["sample"], ["FMT.AF"], "string_agg", ".")), len(master)
+
+
+def case_aggregate_join_columns(data: str, scratch: str):
+    import mucor.aggregate as aggregate
+    master = sorted_master(data)
+    piv = aggregate.pivot_values(master, VARIANT_FIELDS, ["sample"], ["FMT.AF"], ".")["FMT.AF"]
+    return (lambda: aggregate.join_columns_unmerged(master, piv, VARIANT_FIELDS, ["INFO.ANN.gene_name"])), len(master)
+
+
+def case_fix_cells(data: str, scratch: str):
+    from mucor.mucor import fix_cells
+    master = read_master(data)
+    return (lambda: master.applymap(fix_cells)), len(master)
+
+
+def case_scrub_convert_numerics(data: str, scratch: str):
+    scrub = load_file_module("scrub", os.path.join(ES_DIR, "scrub.py"))
+    with open(data) as f:
+        lines = f.readlines()
+
+    def run():
+        for line in lines:
+            json.loads(line, object_hook=scrub.convert_numerics)
+    return run, len(lines)
+
+
+class StubElasticsearch(threading.Thread):
+    """
+    Minimal http server answering the requests the elasticsearch client
+    makes for a bulk load, so indexing can be timed without a cluster.
+    """
+
+    def __init__(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body: dict):
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                self.reply({"name": "stub", "cluster_name": "stub", "tagline": "You Know, for Search",
+                            "version": {"number": "7.17.0", "build_flavor": "default"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                actions = [json.loads(x) for x in body.splitlines()[0::2] if x.strip()]
+                items = [{op: {"_index": meta.get("_index"), "status": 201, "result": "created"}}
+                         for action in actions for op, meta in action.items()]
+                self.reply({"took": 1, "errors": False, "items": items})
+
+            do_PUT = do_POST
+
+        super().__init__(daemon=True)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def run(self):
+        self.server.serve_forever()
+
+
+def case_indexer_form_query(data: str, scratch: str):
+    try:
+        indexer = load_file_module("indexer", os.path.join(ES_DIR, "indexer.py"))
+        from elasticsearch import Elasticsearch, helpers
+    except ImportError as e:
+        raise Skip("elasticsearch client not installed: {}".format(e))
+    stub = StubElasticsearch()
+    stub.start()
+    es = Elasticsearch(stub.url)
+    with open(data) as f:
+        rows = sum(1 for _ in f)
+
+    def run():
+        with open(data) as f:
+            sys.stdin = f
+            helpers.bulk(es, indexer.form_query("benchmark", es))
+    return run, rows
+
+
+CASES = {
+    "mucor_main": case_mucor_main,
+    "mucor_main_merge": case_mucor_main_merge,
+    "merge_rows": case_merge_rows,
+    "merge_rows_unique": case_merge_rows_unique,
+    "aggregate_pivot": case_aggregate_pivot,
+    "aggregate_join_columns": case_aggregate_join_columns,
+    "fix_cells": case_fix_cells,
+    "scrub_convert_numerics": case_scrub_convert_numerics,
+    "indexer_form_query": case_indexer_form_query,
+}
+
+
+def run_case(name: str, data: str) -> dict:
+    """
+    Runs one case in this process and returns its measurements.
+    """
+    scratch = tempfile.mkdtemp(prefix="mucor_bench_")
+    try:
+        try:
+            func, rows = CASES[name](data, scratch)
+        except Skip as e:
+            return {"skipped": str(e)}
+        setup_rss = max_rss_mb()
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        func()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        return {"wall_s": wall, "cpu_s": cpu, "peak_rss_mb": max_rss_mb(),
+                "setup_rss_mb": setup_rss, "rows": rows}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def spawn_case(name: str, data: str) -> dict:
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-case", name, "--data", data],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "exit code {}".format(proc.returncode)}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def mucor_version() -> str:
+    try:
+        return subprocess.run(["git", "-C", REPO_DIR, "describe", "--always", "--dirty"],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def library_versions() -> dict:
+    versions = {"python": platform.python_version()}
+    for lib in ("pandas", "numpy"):
+        try:
+            versions[lib] = __import__(lib).__version__
+        except ImportError:
+            versions[lib] = None
+    return versions
+
+
+def load_history(fn: str) -> list:
+    if not os.path.exists(fn):
+        return []
+    with open(fn) as f:
+        return json.load(f)
+
+
+def previous_run(history: list, params: dict):
+    for entry in reversed(history):
+        if entry["params"] == params:
+            return entry
+    return None
+
+
+def report(entry: dict, previous) -> list:
+    """
+    Prints the results of a run next to the previous comparable run and
+    returns the wall time ratios.
+    """
+    ratios = dict()
+    print("{:<24}{:>10}{:>10}{:>12}{:>10}".format("case", "wall s", "cpu s", "peak MB", "vs prev"))
+    for name, res in entry["results"].items():
+        if "wall_s" not in res:
+            print("{:<24}{}".format(name, res.get("skipped") or res.get("error")))
+            continue
+        change = ""
+        if previous is not None and "wall_s" in previous["results"].get(name, {}):
+            ratios[name] = res["wall_s"] / max(previous["results"][name]["wall_s"], 1e-9)
+            change = "{:.2f}x".format(ratios[name])
+        print("{:<24}{:>10.3f}{:>10.3f}{:>12.1f}{:>10}".format(name, res["wall_s"], res["cpu_s"],
+                                                             res["peak_rss_mb"], change))
+    return ratios
+
+
+def form_parser() -> argparse.ArgumentParser:
+    parser = generate.form_parser()
+    parser.description = "Benchmark mucor3 on synthetic atomized data"
+    parser.add_argument("-c", "--cases", nargs="+", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("-d", "--data", default=None, help="benchmark an existing jsonl instead of generated data")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="runs per case, the fastest is kept")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="json file results are appended to")
+    parser.add_argument("--fail-above", type=float, default=None,
+                        help="exit with an error if a case is slower than the previous run by this ratio")
+    parser.add_argument("--run-case", default=None, help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = form_parser().parse_args()
+    if args.run_case is not None:
+        print(json.dumps(run_case(args.run_case, args.data)))
+        return
+
+    workdir = tempfile.mkdtemp(prefix="mucor_bench_data_")
+    try:
+        if args.data is None:
+            params = generate.params_from_args(args)
+            data = os.path.join(workdir, "data.jsonl")
+            with open(data, "w") as f:
+                params["records"] = generate.generate(f, **params)
+        else:
+            data = os.path.abspath(args.data)
+            params = {"data": data, "size": os.path.getsize(data)}
+
+        results = dict()
+        for name in args.cases:
+            runs = [spawn_case(name, data) for _ in range(args.repeat)]
+            timed = [x for x in runs if "wall_s" in x]
+            results[name] = min(timed, key=lambda x: x["wall_s"]) if timed else runs[0]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    history = load_history(args.history)
+    entry = {"timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+             "version": mucor_version(),
+             "host": platform.node(),
+             "libraries": library_versions(),
+             "params": params,
+             "results": results}
+    ratios = report(entry, previous_run(history, params))
+    history.append(entry)
+    with open(args.history, "w") as f:
+        json.dump(history, f, indent=1)
+
+    if args.fail_above is not None:
+        slow = {k: v for k, v in ratios.items() if v > args.fail_above}
+        if len(slow) != 0:
+            print("Error: slower than the previous run: {}".format(
+                ", ".join("{} {:.2f}x".format(k, v) for k, v in slow.items())), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
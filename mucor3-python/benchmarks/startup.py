@@ -0,0 +1,116 @@
+""" Startup benchmark for the mucor3 command line tools.
+
+Runs --help, an invalid invocation and small json streaming jobs for each
+tool in a fresh interpreter and reports the median wall time next to a bare
+interpreter. Python's -X importtime output is used to check that none of
+pandas, numpy or the elasticsearch clients are imported on these paths.
+Exits with an error if a heavy module is imported or, with --budget, if a
+command takes longer than the budget above the bare interpreter.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeat 20 --budget 50
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.dirname(BENCH_DIR)
+REPO_DIR = os.path.dirname(PYTHON_DIR)
+
+# modules that must not be imported just to start a tool
+HEAVY_MODULES = ["pandas", "numpy", "elasticsearch", "elasticsearch_dsl", "openpyxl"]
+
+
+def commands(scratch: str) -> list:
+    """
+    Returns (name, argv, stdin file) for every command to time.
+    """
+    datasheet = os.path.join(scratch, "sheet.jsonl")
+    stream = os.path.join(scratch, "stream.jsonl")
+    with open(datasheet, "w") as f:
+        f.write(json.dumps({"old": "sample", "new": "patient", "value": "P1"}) + "\n")
+    with open(stream, "w") as f:
+        for i in range(100):
+            f.write(json.dumps({"sample": "S" + str(i), "CHROM": "chr1", "POS": i, "old": i}) + "\n")
+    mucor = os.path.join(PYTHON_DIR, "mucor")
+    utils = os.path.join(PYTHON_DIR, "utils")
+    es = os.path.join(REPO_DIR, "elasticsearch")
+    return [
+        ("python", ["-c", "pass"], None),
+        ("mucor3 --help", ["-m", "mucor.mucor", "--help"], None),
+        ("mucor3 bad args", ["-m", "mucor.mucor"], None),
+        ("mucor3 partial --help", ["-m", "mucor.mucor", "partial", "--help"], None),
+        ("mucor3 combine --help", ["-m", "mucor.mucor", "combine", "--help"], None),
+        ("mucor3 diff --help", ["-m", "mucor.mucor", "diff", "--help"], None),
+        ("merge.py --help", [os.path.join(mucor, "merge.py"), "--help"], None),
+        ("aggregate.py --help", [os.path.join(mucor, "aggregate.py"), "--help"], None),
+        ("jsonlcsv.py --help", [os.path.join(mucor, "jsonlcsv.py"), "--help"], None),
+        ("jsonlcsv.py stream", [os.path.join(mucor, "jsonlcsv.py"), "-f", "sample", "CHROM", "POS"], stream),
+        ("jsonlxlsx.py --help", [os.path.join(mucor, "jsonlxlsx.py"), "--help"], None),
+        ("jsonl2csv.py --help", [os.path.join(utils, "jsonl2csv.py"), "--help"], None),
+        ("convert_samples.py --help", [os.path.join(utils, "convert_samples.py"), "--help"], None),
+        ("alter_keys.py stream", [os.path.join(utils, "alter_keys.py"), datasheet, "old=new"], stream),
+        ("alter_values.py stream", [os.path.join(utils, "alter_values.py"), datasheet, "sample=old", "value"], stream),
+        ("query.py --help", [os.path.join(es, "query.py"), "--help"], None),
+        ("indexer.py --help", [os.path.join(es, "indexer.py"), "--help"], None),
+        ("scrub.py stream", [os.path.join(es, "scrub.py")], stream),
+    ]
+
+
+def run(argv: list, stdin: str, importtime: bool = False):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = PYTHON_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + argv
+    with open(stdin or os.devnull) as f:
+        start = time.perf_counter()
+        proc = subprocess.run(cmd, stdin=f, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                              cwd=PYTHON_DIR, env=env, text=True)
+        return time.perf_counter() - start, proc.stderr
+
+
+def imported_modules(importtime: str) -> set:
+    # lines look like "import time:       123 |        456 |   pandas.core"
+    modules = set()
+    for line in importtime.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return modules
+
+
+def form_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Measure startup time of the mucor3 command line tools")
+    parser.add_argument("-r", "--repeat", type=int, default=10, help="runs per command, the median is reported")
+    parser.add_argument("-b", "--budget", type=float, default=None,
+                        help="fail if a command takes more than this many ms longer than a bare interpreter")
+    return parser
+
+
+def main():
+    args = form_parser().parse_args()
+    failed = []
+    with tempfile.TemporaryDirectory(prefix="mucor_startup_") as scratch:
+        base = None
+        print("{:<28}{:>10}{:>12}  {}".format("command", "ms", "+python ms", "heavy imports"))
+        for name, argv, stdin in commands(scratch):
+            wall = statistics.median(run(argv, stdin)[0] for _ in range(args.repeat)) * 1000
+            if base is None:
+                base = wall
+            heavy = sorted(imported_modules(run(argv, stdin, True)[1]) & set(HEAVY_MODULES))
+            print("{:<28}{:>10.1f}{:>12.1f}  {}".format(name, wall, wall - base, ",".join(heavy)))
+            if len(heavy) != 0:
+                failed.append("{} imports {}".format(name, ",".join(heavy)))
+            if args.budget is not None and wall - base > args.budget:
+                failed.append("{} takes {:.1f} ms".format(name, wall - base))
+    if len(failed) != 0:
+        print("Error: " + "; ".join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,18 @@
+from __future__ import annotations
 import argparse
-import pandas as pd
-import numpy as np
+try:
+    from mucor.lazy import lazy_import
+    import mucor.keys as keys
+    import mucor.reader as reader
+    from mucor.filter import QueryError, compile_query
+except ImportError:
+    # run as a script from this directory
+    from lazy import lazy_import
+    import keys
+    import reader
+    from filter import QueryError, compile_query
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
 import sys
 
 
@@ -52,6 +64,62 @@ def pivot(master: pd.DataFrame, pivot_index: list,
     piv.reset_index(inplace=True)
     return piv
 
+def pivot_values(master: pd.DataFrame, pivot_index: list, pivot_on: list,
+                 pivot_values: list, fill_value: str) -> dict:
+    """
+    Pivots several value columns at once. Gives the same tables as
+    pivot(master, pivot_index, pivot_on, [value], "string_agg", fill_value)
+    for each value, but rows and columns are factorized only once, on
+    integer keys from mucor.keys, and master is not modified. Rows are
+    sorted with CHROM in karyotype order. Rows and columns without any
+    value are dropped.
+
+    :param master: Dataframe to be pivoted.
+    :type master: pd.Dataframe
+    :param pivot_index: columns identifying a row of the pivoted tables
+    :type pivot_index: list
+    :param pivot_on: columns whose values become the columns of the pivoted tables
+    :type pivot_on: list
+    :param pivot_values: columns to display in the pivoted tables
+    :type pivot_values: list
+    :param fill_value: value for empty cells
+    :type fill_value: str
+    :return: dict of value column to pd.Dataframe
+    """
+    rows, row_first = keys.group_ids(master, pivot_index)
+    cols, col_first = keys.group_ids(master, pivot_on)
+    row_keys = master[pivot_index].iloc[row_first].reset_index(drop=True)
+    if len(pivot_on) == 1:
+        col_keys = pd.Index(master[pivot_on[0]].iloc[col_first])
+    else:
+        col_keys = pd.MultiIndex.from_frame(master[pivot_on].iloc[col_first])
+    ncols = len(col_keys)
+    cells = rows * ncols + cols
+
+    tables = dict()
+    for value in pivot_values:
+        mask = (master[value].notna().to_numpy()) & (rows != -1) & (cols != -1)
+        cell = cells[mask]
+        vals = master[value].to_numpy()[mask]
+        if len(np.unique(cell)) != len(cell):
+            # several rows per cell, keep the smallest value like string_agg
+            agg = pd.Series(vals, index=cell).groupby(level=0).min()
+            cell, vals = agg.index.to_numpy(), agg.to_numpy()
+        grid = np.full((len(row_first), ncols), fill_value, dtype=object)
+        grid.flat[cell] = vals
+        has_row = np.zeros(len(row_first), dtype=bool)
+        has_row[cell // ncols] = True
+        has_col = np.zeros(ncols, dtype=bool)
+        has_col[cell % ncols] = True
+
+        piv = row_keys[has_row].reset_index(drop=True)
+        values = pd.DataFrame(grid[has_row][:, has_col], columns=col_keys[has_col])
+        values.columns.name = None
+        piv = pd.concat([piv, values], axis=1)
+        piv.columns.name = pivot_on[0] if len(pivot_on) == 1 else None
+        tables[value] = piv
+    return tables
+
 def add_result_metrics(piv: pd.DataFrame, index: list):
     piv.insert(len(index),
         "Positive results",
@@ -63,51 +131,82 @@ def add_result_metrics(piv: pd.DataFrame, index: list):
             .sum(axis=1))/(piv.shape[1]-(len(index)+1)))
     return piv
 
+def first_rows(master: pd.DataFrame, index: list) -> tuple:
+    """
+    Builds a hash lookup from the integer key (see mucor.keys) of each
+    index of master to the position of its first row. master is not
+    copied, modified or sorted.
+
+    :param master: Dataframe to take columns from.
+    :type master: pd.Dataframe
+    :param index: list of columns for indexing dataframes
+    :type index: list
+    :return: key encoder, unique keys as a pd.MultiIndex and the row position of each key
+    """
+    encoder = keys.KeyEncoder(index, master)
+    codes = pd.MultiIndex.from_arrays(encoder.encode(master))
+    first = ~codes.duplicated()
+    return encoder, codes[first], np.flatnonzero(first)
+
+def gather_columns(master: pd.DataFrame, lookup: tuple, piv: pd.DataFrame, index: list, join: list):
+    """
+    Adds the join columns of master to the end of piv using a lookup from
+    first_rows. Rows of piv keep their order and keys missing from master
+    get empty values. Neither frame is modified.
+
+    :param master: Dataframe the lookup was built from.
+    :type master: pd.Dataframe
+    :param lookup: keys and row positions from first_rows
+    :type lookup: tuple
+    :param piv: pivoted Dataframe.
+    :type piv: pd.Dataframe
+    :param index: list of columns for indexing dataframes
+    :type index: list
+    :param join: list of columns to join from master
+    :type join: list
+    :return: pd.Dataframe
+    """
+    encoder, codes, positions = lookup
+    found = codes.get_indexer(pd.MultiIndex.from_arrays(encoder.encode(piv)))
+    rows = np.where(found == -1, -1, positions[found])
+    joined = pd.DataFrame({x: pd.api.extensions.take(master[x].to_numpy(), rows, allow_fill=True)
+                           for x in join}, index=piv.index)
+    return pd.concat([piv, joined], axis=1)
+
 def join_columns(master: pd.DataFrame, piv: pd.DataFrame, index: list, join: list):
     """
-    Creates a pivot table using master dataframe and the arguments provided at runtime.
+    Adds the join columns of master to the pivot table. master should
+    have one row per index, see join_columns_unmerged otherwise.
 
     :param master: Dataframe to merge columns from.
     :type master: pd.Dataframe
-    :param master: pivoted Dataframe.
-    :type master: pd.Dataframe
+    :param piv: pivoted Dataframe.
+    :type piv: pd.Dataframe
     :param index: list of columns for indexing dataframes
     :type index: list
     :param join: list of columns to join from master
     :type join: list
     :return: pd.Dataframe
     """
-    master.set_index(index,inplace=True)
-    piv.set_index(index,inplace=True)
-    master.sort_index(inplace=True)
-    piv.sort_index(inplace=True)
-    piv=piv.join(master[join])
-    master.reset_index(inplace=True)
-    piv.reset_index(inplace=True)
-    return piv
+    return gather_columns(master, first_rows(master, index), piv, index, join)
 
 def join_columns_unmerged(master: pd.DataFrame, piv: pd.DataFrame, index: list, join: list):
     """
-    Creates a pivot table using master dataframe and the arguments provided at runtime.
+    Adds the join columns of the first row of master for each index to the
+    pivot table.
 
     :param master: Dataframe to merge columns from.
     :type master: pd.Dataframe
-    :param master: pivoted Dataframe.
-    :type master: pd.Dataframe
+    :param piv: pivoted Dataframe.
+    :type piv: pd.Dataframe
     :param index: list of columns for indexing dataframes
     :type index: list
     :param join: list of columns to join from master
     :type join: list
     :return: pd.Dataframe
     """
-    gb = master.groupby(index).head(1)
-    gb.set_index(index,inplace=True)
-    piv.set_index(index,inplace=True)
-    gb.sort_index(inplace=True)
-    piv.sort_index(inplace=True)
-    piv=piv.join(gb[join])
-    piv.reset_index(inplace=True)
-    return piv
+    # the lookup keeps the first row of each index
+    return join_columns(master, piv, index, join)
 
 
 
@@ -119,6 +218,12 @@ def form_parser() -> argparse.ArgumentParser:
     parser.add_argument("-f", "--fill_value",default=".")
     parser.add_argument("-t", "--from_tsv",action="store_true")
     parser.add_argument("-a", "--agg-func",default="string_agg")
+    parser.add_argument("-j", "--jobs",type=int,default=None,
+                        help="processes used to parse stdin when it is a file, defaults to the available cpus")
+    parser.add_argument("-i", "--input",action="append",default=None,
+                        help="jsonl file or directory of them to read instead of stdin, may be repeated")
+    parser.add_argument("--filter",default=None,
+                        help="varquery query string, only rows matching it are read")
     return parser
 
 
@@ -127,10 +232,22 @@ if __name__ == "__main__":
     # parse args and open elasticsearch client
     args = form_parser().parse_args()
     data=[]
-    if args.from_tsv:
-        data=pd.read_csv(sys.stdin,delimiter="\t")
-    else:
-        data=pd.read_json(sys.stdin,orient="records",lines=True)
+    try:
+        if args.from_tsv:
+            data=pd.read_csv(sys.stdin,delimiter="\t")
+            if args.filter is not None:
+                match=compile_query(args.filter)
+                data=data[[match(x) for x in data.to_dict("records")]].reset_index(drop=True)
+        else:
+            # only the columns the pivot uses are parsed
+            columns=args.pivot_index+args.pivot_on+args.pivot_value if args.filter is not None else None
+            if args.input is not None:
+                data=reader.read_inputs(args.input,args.jobs,args.filter,columns)
+            else:
+                data=reader.read_stdin(args.jobs,args.filter,columns)
+    except QueryError as e:
+        print("Error: invalid query,", e)
+        sys.exit(1)
     for i,x in enumerate(args.pivot_value):
         if x in args.pivot_index:
             col=x+"2"
@@ -0,0 +1,145 @@
+from __future__ import annotations
+from mucor.lazy import lazy_import
+pd = lazy_import("pandas")
+import mucor.aggregate as aggregate
+import mucor.merge as merge
+
+VARIANT_FIELDS=["CHROM", "POS", "REF", "ALT"]
+REQUIRED_FIELDS=["sample"]+VARIANT_FIELDS
+
+# The atomizer writes one row per snpEff ANN transcript, repeating the
+# sample's FORMAT and INFO fields on each. With --ann-table the INFO.ANN.*
+# columns (and EFFECT, which is derived from them) are split into a table
+# of the distinct transcripts of each variant, shared by all samples. The
+# split is done on each chunk of rows as the jsonl is parsed (see
+# AnnotationSplitter), so the rows of every sample times every transcript
+# are never held at once. Rows are merged per sample without the
+# annotations and per variant on the annotation table, and the merged
+# annotations are joined back onto the per-sample rows. Memory and the
+# merge then scale with records and distinct variants instead of samples
+# times transcripts.
+
+ANN_PREFIX="INFO.ANN."
+
+
+def annotation_columns(master: pd.DataFrame) -> list:
+    return [x for x in master.columns if x.startswith(ANN_PREFIX) or x == "EFFECT"]
+
+
+def as_tuple(x):
+    # lists can not be hashed to find duplicate rows, tuples can
+    return tuple(as_tuple(y) for y in x) if type(x) is list else x
+
+
+def hashable(col: pd.Series) -> pd.Series:
+    if col.dtype != object:
+        return col
+    return col.map(as_tuple)
+
+
+def distinct_rows(df: pd.DataFrame, cols: list) -> pd.DataFrame:
+    """
+    Returns the rows of df that differ in cols, keeping only cols.
+    """
+    dup = pd.DataFrame({x: hashable(df[x]) for x in cols}).duplicated()
+    return df.loc[~dup.to_numpy(), cols].reset_index(drop=True)
+
+
+def add_effect(master: pd.DataFrame):
+    #create EFFECT column
+    if("INFO.ANN.hgvs_p" in master):
+        master["EFFECT"]=master["INFO.ANN.hgvs_p"]
+        master["EFFECT"].fillna(master["INFO.ANN.effect"],inplace=True)
+
+
+def missing_as_none(col: pd.Series) -> pd.Series:
+    # NaN != NaN, so missing values are replaced to compare rows in a set
+    col = hashable(col).astype(object)
+    return col.where(col.notna(), None)
+
+
+class AnnotationSplitter:
+    """
+    Splits chunks of atomized rows into sample-level rows and annotations.
+    Annotation rows already returned for an earlier chunk are dropped, so
+    the annotations kept while a file is read grow with the distinct
+    annotations rather than with samples. Pass an instance as the split of
+    mucor.reader.read_jsonl and finish with distinct_split.
+    """
+
+    def __init__(self):
+        self.seen = dict()
+
+    def __call__(self, chunk: pd.DataFrame) -> tuple:
+        """
+        :param chunk: atomized rows
+        :type chunk: pd.Dataframe
+        :return: rows without annotation columns, new annotation rows, and an empty dataframe with the columns of chunk
+        """
+        template = chunk.iloc[:0]
+        add_effect(chunk)
+        ann_cols = annotation_columns(chunk)
+        rest = [x for x in chunk.columns if x not in ann_cols]
+        ann_cols = [x for x in VARIANT_FIELDS if x in chunk] + ann_cols
+        seen = self.seen.setdefault(tuple(ann_cols), set())
+        new = [not (x in seen or seen.add(x)) for x in zip(*[missing_as_none(chunk[x]) for x in ann_cols])]
+        return distinct_rows(chunk, rest), chunk.loc[new, ann_cols].reset_index(drop=True), template
+
+
+def distinct_split(rows: pd.DataFrame, annotations: pd.DataFrame, template: pd.DataFrame) -> tuple:
+    """
+    Removes the rows and annotations repeated across the chunks split by
+    AnnotationSplitter, i.e. a record whose transcripts straddle two chunks.
+
+    :return: one row per record without annotation columns, the distinct annotations of each variant and an empty dataframe with all atomized columns
+    """
+    return (distinct_rows(rows, list(rows.columns)),
+            distinct_rows(annotations, list(annotations.columns)), template)
+
+
+def merge_annotated(rows: pd.DataFrame, annotations: pd.DataFrame, columns: list) -> tuple:
+    """
+    Merges rows per sample and variant like merge.merge_rows, with the
+    annotations merged once per variant and joined back. Identical
+    records repeated for each transcript are merged once, so list fields
+    such as FMT.AD are no longer repeated per transcript.
+
+    :param rows: sorted sample-level rows from distinct_split
+    :type rows: pd.Dataframe
+    :param annotations: annotations from distinct_split
+    :type annotations: pd.Dataframe
+    :param columns: column order of the result
+    :type columns: list
+    :return: merged per-sample rows and merged annotations per variant
+    """
+    ann_cols = [x for x in annotations.columns if x not in VARIANT_FIELDS]
+    rows = merge.merge_rows(rows, REQUIRED_FIELDS)
+    annotations = merge.merge_rows(annotations, VARIANT_FIELDS)
+    merged = join_annotations(rows, annotations, ann_cols)
+    return merged.loc[:, [x for x in columns if x in merged.columns]], annotations
+
+
+def join_annotations(rows: pd.DataFrame, annotations: pd.DataFrame, ann_cols: list) -> pd.DataFrame:
+    """
+    Adds the merged annotations of each variant to rows.
+    """
+    lookup = aggregate.first_rows(annotations, VARIANT_FIELDS)
+    return aggregate.gather_columns(annotations, lookup, rows, VARIANT_FIELDS, ann_cols)
+
+
+def condense(merged: pd.DataFrame, annotations: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merges per-sample rows per variant like merge.merge_rows_unique,
+    taking the annotations from the annotation table.
+
+    :param merged: merged per-sample rows
+    :type merged: pd.Dataframe
+    :param annotations: merged annotations per variant
+    :type annotations: pd.Dataframe
+    :return: pd.Dataframe
+    """
+    ann_cols = [x for x in annotation_columns(merged) if x in annotations.columns]
+    rest = [x for x in merged.columns if x not in ann_cols]
+    condensed = merge.merge_rows_unique(merged.loc[:, rest], VARIANT_FIELDS)
+    condensed = join_annotations(condensed, annotations, ann_cols)
+    return condensed.loc[:, [x for x in merged.columns if x in condensed.columns]]
@@ -0,0 +1,138 @@
+import json
+import os
+import sys
+
+VARIANT_FIELDS=["CHROM", "POS", "REF", "ALT"]
+
+# Compares the variants of two atomized jsonl files, e.g. calls from two
+# caller versions. Variant and sample-variant keys are kept as their
+# compact json serialization, the same lines compare.sh creates with
+# jq -c "{CHROM, POS, REF, ALT}", so both inputs are read once and the
+# lost, gained and retained sets come from set operations instead of
+# sort | uniq and comm.
+
+
+class VariantSets:
+    """
+    Unique variants and sample-variants of one input, plus the
+    sample-variants of the records matching a filter.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.filtered_records = 0
+        self.variants = set()
+        self.sample_variants = set()
+        self.filtered_sample_variants = set()
+
+
+def key_lines(record: dict) -> tuple:
+    """
+    Returns the {CHROM, POS, REF, ALT} and {CHROM, POS, REF, ALT, sample}
+    lines of a record as bytes.
+    """
+    var = json.dumps({x: record.get(x) for x in VARIANT_FIELDS}, separators=(",", ":"), ensure_ascii=False)
+    sample = var[:-1] + ',"sample":' + json.dumps(record.get("sample"), ensure_ascii=False) + "}"
+    return var.encode(), sample.encode()
+
+
+def scan(fn: str, query=None, filtered=None) -> VariantSets:
+    """
+    Collects the variant sets of an atomized jsonl file in one pass.
+
+    :param fn: jsonl file, or - for stdin
+    :type fn: str
+    :param query: compiled filter from mucor.filter.compile_query
+    :param filtered: binary file object the matching records are written to
+    :return: VariantSets
+    """
+    sets = VariantSets()
+    f = sys.stdin.buffer if fn == "-" else open(fn, "rb")
+    try:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            var, sample = key_lines(record)
+            sets.records += 1
+            sets.variants.add(var)
+            sets.sample_variants.add(sample)
+            if query is not None and query(record):
+                sets.filtered_records += 1
+                sets.filtered_sample_variants.add(sample)
+                if filtered is not None:
+                    filtered.write(line if line.endswith(b"\n") else line + b"\n")
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+    return sets
+
+
+def write_set(keys: set, fn: str):
+    # byte order, as sort with LC_ALL=C
+    with open(fn, "wb") as f:
+        for key in sorted(keys):
+            f.write(key)
+            f.write(b"\n")
+
+
+def write_comparison(a: set, b: set, prefix: str, name: str) -> list:
+    """
+    Writes a.NAME.jsonl, b.NAME.jsonl and the NAME.lost, NAME.gained and
+    NAME.retained sets to prefix. Returns the size of each set.
+    """
+    sets = [(a, "a." + name), (b, "b." + name), (a - b, name + ".lost"),
+            (b - a, name + ".gained"), (a & b, name + ".retained")]
+    for keys, fn in sets:
+        write_set(keys, os.path.join(prefix, fn + ".jsonl"))
+    return [len(x[0]) for x in sets]
+
+
+def format_counts(title: str, counts: list) -> str:
+    return "{}:\n\tSet A:\t{}\n\tSet B:\t{}\n\tLost (A - B):\t{}\n\tGained (B - A):\t{}\n\tRetained (A & B):\t{}\n".format(
+        title, *counts)
+
+
+def diff(a_fn: str, b_fn: str, prefix: str, query: str=None):
+    """
+    Compares two atomized jsonl files and writes the unique, lost, gained
+    and retained variants (var.*.jsonl) and sample-variants
+    (sample.var.*.jsonl) to prefix. If a query is given, the records
+    matching it are written to a.filtered.jsonl and b.filtered.jsonl and
+    their sample-variants are compared as filtered.sample.var.*.jsonl.
+
+    :param a_fn: first jsonl file
+    :type a_fn: str
+    :param b_fn: second jsonl file
+    :type b_fn: str
+    :param prefix: output directory
+    :type prefix: str
+    :param query: varquery query string, see mucor.filter
+    :type query: str
+    :return: str summary of the set sizes
+    """
+    compiled = None
+    if query is not None:
+        from mucor.filter import compile_query
+        compiled = compile_query(query)
+    results = []
+    for name, fn in (("a", a_fn), ("b", b_fn)):
+        if compiled is not None:
+            with open(os.path.join(prefix, name + ".filtered.jsonl"), "wb") as filtered:
+                results.append(scan(fn, compiled, filtered))
+        else:
+            results.append(scan(fn))
+    a, b = results
+
+    summary = "Total Variant Records:\n\tSet A:\t{}\n\tSet B:\t{}\n".format(a.records, b.records)
+    summary += format_counts("Unique Variants",
+                             write_comparison(a.variants, b.variants, prefix, "var"))
+    summary += format_counts("Unique Variants Per Sample",
+                             write_comparison(a.sample_variants, b.sample_variants, prefix, "sample.var"))
+    if compiled is not None:
+        summary += "Filtered Variant Records:\n\tSet A:\t{}\n\tSet B:\t{}\n".format(
+            a.filtered_records, b.filtered_records)
+        summary += format_counts("Filtered Unique Variants Per Sample",
+                                 write_comparison(a.filtered_sample_variants, b.filtered_sample_variants,
+                                                  prefix, "filtered.sample.var"))
+    return summary
@@ -0,0 +1,265 @@
+import re
+
+# Evaluates varquery query strings (see QUERY.md) against json records
+# without building an index, so a filter can be applied while a file is
+# streamed.
+#
+#   key = val                      string, integer, float or boolean equality
+#   key > 1, >=, <, <=             numeric comparisons
+#   key = 1..3                     half-open range, 1 <= key < 3
+#   key = (val1 | val2)            any of several values for one key
+#   key: _exists_                  key is present and not null
+#   a & b, a | b, !a, (a)          and, or, not and grouping
+#
+# ! binds tighter than &, which binds tighter than |. Values and keys with
+# whitespace or operator characters can be quoted with "". Keys may be
+# written as INFO.ANN.effect, INFO/ANN/effect or /INFO/ANN/effect and match
+# both flattened and nested records. When a key holds a list, the
+# comparison is true if it is true for any element.
+
+VALUE_OPS = ["=", ">=", "<=", ">", "<", "~", ":"]
+EXISTS = "_exists_"
+
+TOKEN_RE = re.compile(r'\s*(?:("[^"]*")|(>=|<=|[=><~:&|!()])|([^\s=><~:&|!()"]+))')
+INT_RE = re.compile(r"^-?[0-9]+$")
+
+
+class QueryError(ValueError):
+    pass
+
+
+def tokenize(query: str) -> list:
+    """
+    Splits a query string into (text, is_operator, position) tokens.
+    """
+    tokens = []
+    pos = 0
+    query = query.rstrip()
+    while pos < len(query):
+        m = TOKEN_RE.match(query, pos)
+        if m is None:
+            raise QueryError("unterminated quote at position {} in query: {}".format(pos, query))
+        quoted, op, word = m.groups()
+        if op is not None:
+            tokens.append((op, True, m.start(2)))
+        else:
+            tokens.append((quoted or word, False, m.start(1) if quoted else m.start(3)))
+        pos = m.end()
+    return tokens
+
+
+def parse_value(text: str):
+    """
+    Converts a query value to a string, int, float, bool or range tuple.
+    """
+    if text.startswith('"') and text.endswith('"') and len(text) > 1:
+        return text[1:-1]
+    if ".." in text:
+        start, _, end = text.partition("..")
+        try:
+            if INT_RE.match(start) and INT_RE.match(end):
+                return (int(start), int(end))
+            return (float(start), float(end))
+        except ValueError:
+            return text
+    if INT_RE.match(text):
+        return int(text)
+    for number in (text, text[:-1]):
+        # 0.5f is the float syntax of older varquery versions
+        try:
+            return float(number)
+        except ValueError:
+            if text[-1:] not in ("f", "F"):
+                break
+    if text in ("true", "True", "TRUE"):
+        return True
+    if text in ("false", "False", "FALSE"):
+        return False
+    return text
+
+
+def key_parts(key: str) -> list:
+    if key.startswith('"') and key.endswith('"'):
+        key = key[1:-1]
+    return [x for x in re.split(r"[/.]", key) if x != ""]
+
+
+def lookup(obj, parts: list):
+    """
+    Yields the values at a key path. Nested objects and flattened keys
+    such as "INFO.ANN.effect" are both followed and lists are expanded.
+    """
+    if isinstance(obj, list):
+        for item in obj:
+            yield from lookup(item, parts)
+        return
+    if len(parts) == 0:
+        yield obj
+        return
+    if not isinstance(obj, dict):
+        return
+    for i in range(1, len(parts) + 1):
+        key = ".".join(parts[:i])
+        if key in obj:
+            yield from lookup(obj[key], parts[i:])
+
+
+def is_number(x) -> bool:
+    return (type(x) is int or type(x) is float)
+
+
+def value_test(op: str, value):
+    """
+    Returns a function testing a single record value against value.
+    """
+    if op in ("=", "~"):
+        if type(value) is tuple:
+            start, end = value
+            return lambda x: is_number(x) and start <= x < end
+        if type(value) is bool:
+            return lambda x: type(x) is bool and x == value
+        if is_number(value):
+            return lambda x: is_number(x) and x == value
+        return lambda x: type(x) is str and x == value
+    if not is_number(value):
+        raise QueryError("operator {} needs a number, found: {}".format(op, value))
+    if op == ">":
+        return lambda x: is_number(x) and x > value
+    if op == ">=":
+        return lambda x: is_number(x) and x >= value
+    if op == "<":
+        return lambda x: is_number(x) and x < value
+    return lambda x: is_number(x) and x <= value
+
+
+def key_test(key: str, op: str, value):
+    parts = key_parts(key)
+    if op == ":":
+        if value != EXISTS:
+            raise QueryError("expected {} after {}:".format(EXISTS, key))
+        test = lambda x: True
+    else:
+        test = value_test(op, value)
+    name = ".".join(parts)
+
+    def match(record):
+        # flattened keys are the common case for atomized records
+        if name in record:
+            x = record[name]
+            if type(x) is list:
+                return any(y is not None and test(y) for y in lookup(x, []))
+            return x is not None and test(x)
+        return any(x is not None and test(x) for x in lookup(record, parts))
+    return match
+
+
+class Parser:
+    """
+    Recursive descent parser turning query tokens into a predicate.
+    """
+
+    def __init__(self, query: str):
+        self.query = query
+        self.tokens = tokenize(query)
+        self.pos = 0
+        self.keys = []
+
+    def error(self, msg: str):
+        where = self.tokens[self.pos][2] if self.pos < len(self.tokens) else len(self.query)
+        raise QueryError("{} at position {} in query: {}".format(msg, where, self.query))
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, False, None)
+
+    def take_op(self, op: str) -> bool:
+        text, is_op, _ = self.peek()
+        if is_op and text == op:
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        if len(self.tokens) == 0:
+            self.error("empty query")
+        pred = self.parse_or(None)
+        if self.pos != len(self.tokens):
+            self.error("unexpected token")
+        return pred
+
+    def parse_or(self, key):
+        preds = [self.parse_and(key)]
+        while self.take_op("|"):
+            preds.append(self.parse_and(key))
+        if len(preds) == 1:
+            return preds[0]
+        return lambda record: any(p(record) for p in preds)
+
+    def parse_and(self, key):
+        preds = [self.parse_not(key)]
+        while self.take_op("&"):
+            preds.append(self.parse_not(key))
+        if len(preds) == 1:
+            return preds[0]
+        return lambda record: all(p(record) for p in preds)
+
+    def parse_not(self, key):
+        if self.take_op("!"):
+            pred = self.parse_not(key)
+            return lambda record: not pred(record)
+        return self.parse_atom(key)
+
+    def parse_atom(self, key):
+        text, is_op, _ = self.peek()
+        if text is None:
+            self.error("unexpected end of query")
+        if is_op:
+            if text != "(":
+                self.error("unexpected operator {}".format(text))
+            self.pos += 1
+            pred = self.parse_or(key)
+            if not self.take_op(")"):
+                self.error("expected )")
+            return pred
+        self.pos += 1
+        op, op_is_op, _ = self.peek()
+        if op_is_op and op in VALUE_OPS:
+            # key op value or key = ( values )
+            self.pos += 1
+            if op == "=" and self.peek()[:2] == ("(", True):
+                return self.parse_atom(text)
+            value, value_is_op, _ = self.peek()
+            if value is None or value_is_op:
+                self.error("expected a value")
+            self.pos += 1
+            self.keys.append(text)
+            return key_test(text, op, value if op == ":" else parse_value(value))
+        # bare value inside key = ( ... )
+        if key is None:
+            self.error("value {} has no key".format(text))
+        self.keys.append(key)
+        return key_test(key, "=", parse_value(text))
+
+
+def compile_query(query: str):
+    """
+    Compiles a varquery query string into a function that takes a json
+    record (dict) and returns whether it matches.
+
+    :param query: query string
+    :type query: str
+    :return: function
+    """
+    return Parser(query).parse()
+
+
+def query_keys(query: str) -> list:
+    """
+    Returns the keys a query string refers to.
+
+    :param query: query string
+    :type query: str
+    :return: list
+    """
+    parser = Parser(query)
+    parser.parse()
+    return list(dict.fromkeys(parser.keys))
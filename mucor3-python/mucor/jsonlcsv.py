@@ -1,23 +1,144 @@
-import pandas as pd
+from __future__ import annotations
+try:
+    from mucor.lazy import lazy_import
+except ImportError:
+    # run as a script from this directory
+    from lazy import lazy_import
+pd = lazy_import("pandas")
 import sys
+import os
+import io
+import csv
+import json
+import shutil
+import tempfile
 import argparse
+from functools import partial
+from itertools import islice
 
 def jsonl2tsv(master: pd.DataFrame,index: list,fn: str):
-    master.set_index(index,inplace=True)
-    master.reset_index(inplace=True)
-    master.to_csv(fn,sep="\t",index=False)
+    cols = index + [x for x in master.columns if x not in index]
+    master[cols].to_csv(fn,sep="\t",index=False)
 
-if __name__=="__main__":
-    parser=argparse.ArgumentParser()
+def batch_fields(lines: list) -> list:
+    """
+    Returns the keys of a batch of jsonl lines in order of first appearance.
+    """
+    fields = dict()
+    for line in lines:
+        if line.strip():
+            fields.update(dict.fromkeys(json.loads(line)))
+    return list(fields)
+
+def batch_rows(lines: list, header: list, delimiter: str) -> str:
+    """
+    Formats a batch of jsonl lines as delimited text in header order.
+    """
+    # csv writes None as an empty field and other values with str() like pandas
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter=delimiter, lineterminator="\n")
+    writer.writerows(map(json.loads(line).get, header) for line in lines if line.strip())
+    return out.getvalue()
+
+def read_batches(f, batch_size: int):
+    while True:
+        batch = list(islice(f, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+def map_batches(fn: str, func, threads: int, batch_size: int):
+    """
+    Applies func to batches of lines of fn, using a process pool when
+    threads > 1. Results are yielded in input order.
+    """
+    with open(fn, "r") as f:
+        if threads > 1:
+            from multiprocessing import Pool
+            with Pool(threads) as pool:
+                for res in pool.imap(func, read_batches(f, batch_size)):
+                    yield res
+        else:
+            for batch in read_batches(f, batch_size):
+                yield func(batch)
+
+def discover_fields(fn: str, threads: int=1, batch_size: int=10000) -> list:
+    """
+    Finds the union of keys of a jsonl file in order of first appearance.
+
+    :param fn: jsonl file
+    :type fn: str
+    :param threads: number of processes
+    :type threads: int
+    :param batch_size: number of lines per batch
+    :type batch_size: int
+    :return: list
+    """
+    fields = dict()
+    for keys in map_batches(fn, batch_fields, threads, batch_size):
+        for key in keys:
+            fields[key] = None
+    return list(fields)
+
+def stream_jsonl2csv(fn: str, out, delimiter: str=",", index: list=[], fields: list=None,
+                     threads: int=1, batch_size: int=10000):
+    """
+    Converts jsonl to delimited text without loading it into a dataframe.
+    When no header is given the columns are discovered with a first pass
+    over the file. Index columns are written first.
+
+    :param fn: jsonl file, or - for stdin
+    :type fn: str
+    :param out: text file object to write to
+    :param delimiter: column delimiter
+    :type delimiter: str
+    :param index: columns to write first
+    :type index: list
+    :param fields: fixed header, skips column discovery
+    :type fields: list
+    :param threads: number of processes
+    :type threads: int
+    :param batch_size: number of lines per batch
+    :type batch_size: int
+    """
+    spool = None
+    if fn == "-":
+        if fields is None:
+            # stdin can only be read once so spool it for the discovery pass
+            spool = tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False)
+            shutil.copyfileobj(sys.stdin, spool)
+            spool.close()
+            fn = spool.name
+        else:
+            fn = "/dev/stdin"
+    try:
+        if fields is None:
+            fields = discover_fields(fn, threads, batch_size)
+        header = index + [x for x in fields if x not in index]
+        csv.writer(out, delimiter=delimiter, lineterminator="\n").writerow(header)
+        func = partial(batch_rows, header=header, delimiter=delimiter)
+        for text in map_batches(fn, func, threads, batch_size):
+            out.write(text)
+    finally:
+        if spool is not None:
+            os.remove(spool.name)
+
+def form_parser() -> argparse.ArgumentParser:
+    parser=argparse.ArgumentParser(description="Convert jsonl to delimited text")
     parser.add_argument("-o","--output",default=None)
     parser.add_argument("-d","--delimiter",default=",")
     parser.add_argument("-i","--index",nargs="+",default=[])
-    args=parser.parse_args()
-    data=pd.read_json(sys.stdin,orient="records",lines=True)
-    if args.index!=[]:
-        data.set_index(args.index,inplace=True)
-        data.reset_index(inplace=True)
+    parser.add_argument("-f","--fields",nargs="+",default=None,help="fixed header, skips discovering columns")
+    parser.add_argument("--threads",type=int,default=1,help="number of processes used to convert rows")
+    parser.add_argument("--input",default="-",help="jsonl file, defaults to stdin")
+    return parser
+
+def main(args):
     if args.output:
-        data.to_csv(args.output,sep=args.delimiter)
+        with open(args.output,"w",newline="") as out:
+            stream_jsonl2csv(args.input,out,args.delimiter,args.index,args.fields,args.threads)
     else:
-        data.to_csv(sys.stdout,sep=args.delimiter,index=False)
+        stream_jsonl2csv(args.input,sys.stdout,args.delimiter,args.index,args.fields,args.threads)
+
+if __name__=="__main__":
+    main(form_parser().parse_args())
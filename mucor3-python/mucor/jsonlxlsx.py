@@ -0,0 +1,152 @@
+from __future__ import annotations
+import math
+import sys
+import argparse
+try:
+    from mucor.lazy import lazy_import
+except ImportError:
+    # run as a script from this directory
+    from lazy import lazy_import
+pd = lazy_import("pandas")
+
+# excel worksheet limits
+EXCEL_MAX_ROWS=1048576
+EXCEL_MAX_CHARS=32767
+EXCEL_MAX_SHEET_NAME=31
+
+
+def excel_cell(x, numeric: bool=False):
+    """
+    Converts a dataframe value to something excel can store in one cell.
+    Strings are truncated to the excel cell limit and, for numeric columns,
+    strings holding a single number are written as numbers.
+
+    :param x: value to convert
+    :param numeric: whether the value comes from a numeric column
+    :type numeric: bool
+    :return: cell value
+    """
+    if x is None:
+        return None
+    if isinstance(x, float):
+        if math.isnan(x):
+            return None
+        return x
+    if isinstance(x, (bool, int)):
+        return x
+    if hasattr(x, "item") and not isinstance(x, str):
+        # numpy scalar
+        return excel_cell(x.item(), numeric)
+    if not isinstance(x, str):
+        x = str(x)
+    if numeric:
+        try:
+            num = float(x)
+            if not math.isnan(num) and not math.isinf(num):
+                return num
+        except ValueError:
+            pass
+    if len(x) > EXCEL_MAX_CHARS:
+        print("Warning: row found that was too big to be displayed in excel", file=sys.stderr)
+        x = x[:EXCEL_MAX_CHARS]
+    return x
+
+
+def sheet_names(name: str):
+    """
+    Yields worksheet names for a table split over several sheets.
+    """
+    name = name[:EXCEL_MAX_SHEET_NAME]
+    yield name
+    i = 2
+    while True:
+        suffix = " ({})".format(i)
+        yield name[:EXCEL_MAX_SHEET_NAME-len(suffix)] + suffix
+        i += 1
+
+
+def write_xlsx(header: list, rows, fn: str, name: str="Sheet", numeric: list=[]):
+    """
+    Writes rows to an excel workbook one row at a time so memory use does
+    not grow with the table. Tables longer than an excel sheet are
+    continued on additional sheets, each with the header repeated.
+
+    :param header: column names
+    :type header: list
+    :param rows: iterable of row tuples
+    :param fn: output file name or binary file object
+    :param name: worksheet name
+    :type name: str
+    :param numeric: column names whose values are written as numbers where possible
+    :type numeric: list
+    """
+    try:
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    except ImportError:
+        print("Error: openpyxl is needed to write excel files: pip install openpyxl", file=sys.stderr)
+        sys.exit(1)
+
+    def text_cell(x):
+        # openpyxl would store strings starting with = as formulas
+        x = ILLEGAL_CHARACTERS_RE.sub("", x)
+        if x.startswith("="):
+            cell = WriteOnlyCell(ws, value=x)
+            cell.data_type = "s"
+            return cell
+        return x
+
+    def make_row(row):
+        ret = []
+        for x, n in zip(row, is_numeric):
+            x = excel_cell(x, n)
+            ret.append(text_cell(x) if isinstance(x, str) else x)
+        return ret
+
+    is_numeric = [x in numeric for x in header]
+    wb = Workbook(write_only=True)
+    names = sheet_names(name)
+    ws = None
+    nrows = EXCEL_MAX_ROWS
+    for row in rows:
+        if nrows == EXCEL_MAX_ROWS:
+            ws = wb.create_sheet(next(names))
+            ws.append([text_cell(str(x)) for x in header])
+            nrows = 1
+        ws.append(make_row(row))
+        nrows += 1
+    if ws is None:
+        ws = wb.create_sheet(next(names))
+        ws.append([text_cell(str(x)) for x in header])
+    wb.save(fn)
+
+
+def jsonl2xlsx(master: pd.DataFrame, index: list, fn: str, name: str="Sheet", numeric: list=[]):
+    """
+    Writes a dataframe to an excel workbook with the index columns first.
+
+    :param master: Dataframe to be written
+    :type master: pd.Dataframe
+    :param index: columns to write first
+    :type index: list
+    :param fn: output file name
+    :type fn: str
+    :param name: worksheet name
+    :type name: str
+    :param numeric: columns whose values are written as numbers where possible
+    :type numeric: list
+    """
+    cols = index + [x for x in master.columns if x not in index]
+    write_xlsx(cols, master[cols].itertuples(index=False, name=None), fn, name, numeric)
+
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser()
+    parser.add_argument("-i","--index",nargs="+",default=[])
+    parser.add_argument("-n","--numeric",nargs="+",default=[],help="columns to write as numbers")
+    parser.add_argument("-s","--sheet",default="Sheet",help="worksheet name")
+    parser.add_argument("output")
+    args=parser.parse_args()
+    data=pd.read_json(sys.stdin,orient="records",lines=True)
+    jsonl2xlsx(data,args.index,args.output,args.sheet,args.numeric)
@@ -0,0 +1,376 @@
+from __future__ import annotations
+import re
+try:
+    from mucor.lazy import lazy_import
+except ImportError:
+    # run as a script from this directory
+    from lazy import lazy_import
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Sorting, grouping and joining on CHROM, POS, REF, ALT and sample as
+# tuples of python objects is slow and orders chr10 before chr2. Key columns
+# are instead encoded as integers: CHROM gets a code in karyotype order and
+# is combined with POS into one 64 bit site key, every other column, i.e.
+# REF, ALT and sample, gets its rank in a sorted dictionary. The codes are
+# then packed into as few int64 keys as possible. Codes sort like the values
+# they stand for so the reports come out in genomic order. Only the codes
+# are sorted and grouped, the original columns are taken from the first row
+# of each group when a table is written.
+
+KARYOTYPE = [str(x) for x in range(1, 23)] + ["X", "Y", "M", "MT"]
+KARYOTYPE_RANK = {x: i for i, x in enumerate(KARYOTYPE)}
+NATURAL_RE = re.compile(r"(\d+)")
+# packed keys stay below this so a missing value slot never overflows
+PACK_LIMIT = 2 ** 62
+
+
+def karyotype_key(chrom) -> tuple:
+    """
+    Sort key placing chr1..chr22, X, Y and M first, then other contigs in
+    natural order, i.e. chrUn_2 before chrUn_10. The chr prefix is optional.
+    """
+    name = str(chrom)
+    short = name[3:] if name[:3].lower() == "chr" else name
+    if short in KARYOTYPE_RANK:
+        return (0, KARYOTYPE_RANK[short], name)
+    parts = [(0, int(x), "") if x.isdigit() else (1, 0, x) for x in NATURAL_RE.split(short) if x != ""]
+    return (1, parts, name)
+
+
+def column_codes(field: str, values) -> tuple:
+    """
+    Encodes a key column as the rank of each value in the sorted unique
+    values, CHROM in karyotype order. Missing values are -1.
+
+    :param field: column name
+    :type field: str
+    :param values: column values
+    :type values: pd.Series
+    :return: np.ndarray of codes and the sorted unique values as a pd.Index
+    """
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object if field == "CHROM" else None)
+    if field == "CHROM":
+        order = np.array(sorted(range(len(uniques)), key=lambda i: karyotype_key(uniques[i])), dtype="int64")
+    else:
+        try:
+            order = np.argsort(uniques, kind="stable")
+        except TypeError:
+            # mixed types, i.e. numbers and strings in one column
+            order = np.array(sorted(range(len(uniques)), key=lambda i: (type(uniques[i]).__name__, uniques[i])),
+                             dtype="int64")
+    rank = np.empty(len(uniques), dtype="int64")
+    rank[order] = np.arange(len(uniques))
+    codes = np.where(codes == -1, -1, rank[codes]) if len(uniques) != 0 else codes.astype("int64")
+    return codes, pd.Index(uniques[order], dtype=object)
+
+
+def positions(values) -> np.ndarray:
+    # POS as int64, -1 where it is missing or not a non-negative integer
+    pos = pd.to_numeric(values, errors="coerce")
+    bad = (pos.isna() | (pos < 0) | (pos != pos.round())).to_numpy()
+    pos = pos.fillna(0).to_numpy().astype("int64")
+    pos[bad] = -1
+    return pos
+
+
+class KeyEncoder:
+    """
+    Encodes the key columns of one or more dataframes as integers using
+    the same dictionaries, so codes can be compared across dataframes.
+    CHROM and POS become a single site key, chrom code * pos_radix + POS.
+    """
+
+    def __init__(self, fields: list, *frames):
+        self.fields = list(fields)
+        self.sited = "CHROM" in fields and "POS" in fields
+        self.dictionaries = dict()
+        self.fitted = [dict() for x in frames]
+        sizes = np.cumsum([0] + [len(x) for x in frames])
+        for field in self.fields:
+            if self.sited and field == "POS":
+                continue
+            values = frames[0][field] if len(frames) == 1 else pd.concat([x[field] for x in frames], ignore_index=True)
+            codes, self.dictionaries[field] = column_codes(field, values)
+            for i in range(len(frames)):
+                self.fitted[i][field] = codes[sizes[i]:sizes[i+1]]
+        if self.sited:
+            for i, frame in enumerate(frames):
+                self.fitted[i]["POS"] = positions(frame["POS"])
+            self.pos_radix = 1 + max([int(x["POS"].max()) if len(x["POS"]) else 0 for x in self.fitted] + [0])
+            if len(self.dictionaries["CHROM"]) * self.pos_radix >= PACK_LIMIT:
+                raise ValueError("POS too large to encode")
+
+    def radices(self) -> list:
+        """
+        Returns the number of codes of each component of encode, plus one
+        for missing values.
+        """
+        radices = []
+        for field in self.fields:
+            if self.sited and field == "POS":
+                continue
+            if self.sited and field == "CHROM":
+                radices.append(len(self.dictionaries["CHROM"]) * self.pos_radix + 1)
+            else:
+                radices.append(len(self.dictionaries[field]) + 1)
+        return radices
+
+    def components(self, codes: dict) -> list:
+        components = []
+        for field in self.fields:
+            if self.sited and field == "POS":
+                continue
+            if self.sited and field == "CHROM":
+                chrom, pos = codes["CHROM"], codes["POS"]
+                site = chrom * self.pos_radix + pos
+                site[(chrom == -1) | (pos == -1) | (pos >= self.pos_radix)] = -1
+                components.append(site)
+            else:
+                components.append(codes[field])
+        return components
+
+    def encoded(self, i: int=0) -> list:
+        """
+        Returns the components (see encode) of the i-th dataframe the
+        encoder was built from.
+        """
+        return self.components(self.fitted[i])
+
+    def encode(self, df: pd.DataFrame) -> list:
+        """
+        Returns one int64 array per key component in field order, CHROM
+        and POS giving one site component when both are fields. Missing
+        values and values the encoder has not seen are -1.
+
+        :param df: dataframe with the key fields
+        :type df: pd.Dataframe
+        :return: list of np.ndarray
+        """
+        codes = dict()
+        for field in self.fields:
+            if self.sited and field == "POS":
+                codes[field] = positions(df[field])
+            else:
+                codes[field] = self.dictionaries[field].get_indexer(df[field]).astype("int64")
+        return self.components(codes)
+
+
+def pack(components: list, radices: list) -> list:
+    """
+    Combines components into as few int64 keys as possible, most
+    significant first. Missing values (-1) sort after every other code.
+    """
+    keys = []
+    key, size = None, 1
+    for x, radix in zip(components, radices):
+        x = np.where(x == -1, radix - 1, x)
+        if key is not None and size * radix < PACK_LIMIT:
+            key = key * radix + x
+            size *= radix
+        else:
+            if key is not None:
+                keys.append(key)
+            key, size = x, radix
+    if key is not None:
+        keys.append(key)
+    return keys
+
+
+def sort_order(df: pd.DataFrame, fields: list) -> np.ndarray:
+    """
+    Returns the row positions of df sorted by fields, CHROM in karyotype
+    order. The sort is stable and rows with missing keys come last.
+
+    :param df: dataframe to sort
+    :type df: pd.Dataframe
+    :param fields: key columns in sort order
+    :type fields: list
+    :return: np.ndarray
+    """
+    encoder = KeyEncoder(fields, df)
+    keys = pack(encoder.encoded(), encoder.radices())
+    if len(keys) == 0:
+        return np.arange(len(df))
+    if len(keys) == 1:
+        return np.argsort(keys[0], kind="stable")
+    return np.lexsort(keys[::-1])
+
+
+def sort_frame(df: pd.DataFrame, fields: list) -> pd.DataFrame:
+    """
+    Returns df sorted by fields with a new index, see sort_order.
+    """
+    return df.iloc[sort_order(df, fields)].reset_index(drop=True)
+
+
+def group_ids(df: pd.DataFrame, fields: list) -> tuple:
+    """
+    Numbers the distinct keys of df in sorted order.
+
+    :param df: dataframe to group
+    :type df: pd.Dataframe
+    :param fields: key columns
+    :type fields: list
+    :return: group id of every row (-1 for rows with a missing key) and the position of the first row of each group
+    """
+    encoder = KeyEncoder(fields, df)
+    components = encoder.encoded()
+    missing = np.zeros(len(df), dtype=bool)
+    for x in components:
+        missing |= x == -1
+    keys = pack(components, encoder.radices())
+    if len(keys) == 1:
+        key = keys[0]
+    else:
+        # too many distinct values for one key, number the key tuples
+        key = pd.MultiIndex.from_arrays(keys).factorize(sort=True)[0].astype("int64")
+    valid = np.flatnonzero(~missing) if missing.any() else None
+    if valid is not None:
+        key = key[valid]
+    # ids in order of appearance, then renumbered in key order
+    ids, uniques = pd.factorize(key)
+    # factorize numbers keys as they appear, so a first row has a new highest id
+    first = np.ones(len(ids), dtype=bool)
+    first[1:] = ids[1:] > np.maximum.accumulate(ids)[:-1]
+    first = np.flatnonzero(first)
+    order = np.argsort(uniques, kind="stable")
+    rank = np.empty(len(uniques), dtype="int64")
+    rank[order] = np.arange(len(uniques))
+    if valid is None:
+        return rank[ids], first[order]
+    all_ids = np.full(len(df), -1, dtype="int64")
+    all_ids[valid] = rank[ids]
+    return all_ids, valid[first[order]]
+
+
+def merge_two(a: tuple, b: tuple) -> tuple:
+    # merges two sorted (keys, positions) runs, a first on ties
+    ka, pa = a
+    kb, pb = b
+    at = np.arange(len(ka)) + np.searchsorted(kb, ka, side="left")
+    bt = np.arange(len(kb)) + np.searchsorted(ka, kb, side="right")
+    key = np.empty(len(ka) + len(kb), dtype="int64")
+    pos = np.empty(len(ka) + len(kb), dtype="int64")
+    key[at], key[bt] = ka, kb
+    pos[at], pos[bt] = pa, pb
+    return key, pos
+
+
+def merge_runs(runs: list) -> np.ndarray:
+    """
+    K-way merge of sorted runs of int64 keys. Adjacent runs are merged
+    pairwise, so k runs of n keys in total take log2(k) passes of O(n).
+
+    :param runs: (sorted keys, row positions) tuples
+    :type runs: list
+    :return: row positions in merged key order, ties in run order
+    """
+    if len(runs) == 0:
+        return np.arange(0)
+    while len(runs) > 1:
+        runs = [merge_two(runs[i], runs[i+1]) if i + 1 < len(runs) else runs[i] for i in range(0, len(runs), 2)]
+    return runs[0][1]
+
+
+def heap_merge(runs: list) -> np.ndarray:
+    """
+    K-way merge with a heap for runs whose keys do not pack into one int64.
+    Keys are compared as tuples, so this is slower than merge_runs.
+
+    :param runs: (list of sorted key arrays, row positions) tuples
+    :type runs: list
+    :return: row positions in merged key order, ties in run order
+    """
+    import heapq
+    # the position is the last item of each tuple, it also breaks ties in run order
+    rows = [zip(*[x.tolist() for x in keys], pos.tolist()) for keys, pos in runs]
+    return np.fromiter((x[-1] for x in heapq.merge(*rows)), dtype="int64", count=sum(len(x[1]) for x in runs))
+
+
+def is_sorted(keys: list) -> bool:
+    # compares adjacent rows on the keys, most significant first
+    equal = np.ones(max(len(keys[0]) - 1, 0), dtype=bool)
+    for x in keys:
+        if np.any(equal & (x[1:] < x[:-1])):
+            return False
+        equal &= x[1:] == x[:-1]
+    return True
+
+
+def site_alleles(components: list, radices: list, site: int) -> tuple:
+    """
+    Replaces the components after the site component, i.e. REF and ALT,
+    with the rank of their combination among those seen at the same site.
+    Sites rarely have more than a few alleles, so the key shrinks from the
+    number of distinct REF times ALT values to a handful of codes. Only the
+    distinct variants are sorted to rank them, not every row.
+
+    :param components: key components of all rows, see KeyEncoder.encode
+    :type components: list
+    :param radices: radix of each component
+    :type radices: list
+    :param site: index of the site component
+    :type site: int
+    :return: components and radices
+    """
+    alleles = pack(components[site+1:], radices[site+1:])
+    if len(alleles) != 1:
+        return components, radices
+    # sorted codes of the distinct REF and ALT combinations
+    pairs, distinct = pd.factorize(alleles[0], sort=True)
+    if radices[site] >= PACK_LIMIT // max(len(distinct), 1):
+        return components, radices
+    sites = np.where(components[site] == -1, radices[site] - 1, components[site])
+    codes, variants = pd.factorize(sites * len(distinct) + pairs, sort=True)
+    sites = variants // max(len(distinct), 1)
+    first = np.ones(len(sites), dtype=bool)
+    first[1:] = sites[1:] != sites[:-1]
+    rank = np.arange(len(sites)) - np.maximum.accumulate(np.where(first, np.arange(len(sites)), 0))
+    radix = int(rank.max()) + 1 if len(rank) else 1
+    return components[:site+1] + [rank[codes]], radices[:site+1] + [radix]
+
+
+def merge_frames(frames: list, fields: list) -> pd.DataFrame:
+    """
+    Combines dataframes that are each sorted by fields into one sorted
+    dataframe without sorting it as a whole. Gives the same rows in the
+    same order as sort_frame on the concatenated frames. A frame that is
+    not sorted is sorted on its own before it is merged.
+
+    Keys are packed into one int64 per row, with REF and ALT coded per site
+    (see site_alleles), and the runs merged with merge_runs. Keys that
+    still need several int64 are merged with heap_merge.
+
+    :param frames: dataframes with the key fields
+    :type frames: list
+    :param fields: key columns in sort order
+    :type fields: list
+    :return: pd.Dataframe
+    """
+    master = pd.concat(frames, ignore_index=True, sort=False)
+    encoder = KeyEncoder(fields, *frames)
+    radices = encoder.radices()
+    encoded = [encoder.encoded(i) for i in range(len(frames))]
+    components = [np.concatenate([x[j] for x in encoded]) for j in range(len(radices))]
+    if encoder.sited:
+        site = [x for x in fields if x != "POS"].index("CHROM")
+        components, radices = site_alleles(components, radices, site)
+    packed = pack(components, radices)
+    runs = []
+    offsets = np.cumsum([0] + [len(x) for x in frames])
+    for i in range(len(frames)):
+        run = [x[offsets[i]:offsets[i+1]] for x in packed]
+        if is_sorted(run):
+            order = np.arange(len(run[0]))
+        elif len(run) == 1:
+            order = np.argsort(run[0], kind="stable")
+        else:
+            order = np.lexsort(run[::-1])
+        runs.append(([x[order] for x in run], offsets[i] + order))
+    if len(packed) == 1:
+        order = merge_runs([(keys[0], pos) for keys, pos in runs])
+    else:
+        order = heap_merge(runs)
+    return master.iloc[order].reset_index(drop=True)
@@ -0,0 +1,33 @@
+import importlib
+import sys
+import types
+
+# pandas and numpy take longer to import than most mucor3 invocations take
+# to run their own code. Modules bind them with lazy_import so that --help,
+# argument errors and paths that only stream json never load them.
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module until one of its attributes is used. The real
+    module is then imported and its namespace copied in, so later lookups
+    cost the same as on the module itself.
+    """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    Returns module name, deferring the import until it is first used.
+
+    :param name: module name, i.e. pandas
+    :type name: str
+    :return: module
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
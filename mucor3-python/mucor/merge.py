@@ -1,12 +1,65 @@
-import numpy as np
-import pandas as pd
+from __future__ import annotations
+try:
+    from mucor.lazy import lazy_import
+    import mucor.keys as keys
+    import mucor.reader as reader
+    from mucor.filter import QueryError
+except ImportError:
+    # run as a script from this directory
+    from lazy import lazy_import
+    import keys
+    import reader
+    from filter import QueryError
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
 import argparse
 import sys
 delim=";"
+
+def is_missing(x) -> bool:
+    return x is None or (isinstance(x, float) and x != x)
+
+def group_rows(sub: pd.DataFrame, index: list, func, reduce=None) -> pd.DataFrame:
+    """
+    Aggregates the columns of rows sharing an index with func. Rows are
+    grouped on integer keys from mucor.keys and come out sorted on the
+    index, CHROM in karyotype order. Rows with a missing index are dropped.
+    If reduce is given, it is called with the non-null values of a single
+    row instead of calling func for groups of one row, which avoids the
+    groupby overhead for rows that have nothing to be merged with.
+
+    :param sub: Dataframe to have rows grouped
+    :type sub: pd.Dataframe
+    :param index: list of columns to groupby
+    :type index: list
+    :param func: aggregation applied to each column of a group
+    :type func: function
+    :param reduce: func taking a list of non-null values
+    :type reduce: function
+    :return: pd.Dataframe
+    """
+    ids, first = keys.group_ids(sub, index)
+    cols = [x for x in sub.columns if x not in index]
+    grouped = ids >= 0
+    if reduce is not None:
+        sizes = np.bincount(ids[grouped], minlength=len(first))
+        single = grouped & (sizes[np.where(grouped, ids, 0)] == 1)
+        grouped &= ~single
+    agg = sub[grouped].groupby(ids[grouped])[cols].aggregate(func)
+    if reduce is not None and single.any():
+        singles = pd.DataFrame({x: [reduce([] if is_missing(y) else [y]) for y in sub[x].to_numpy()[single]]
+                                for x in cols}, index=ids[single])
+        agg = pd.concat([agg, singles]).sort_index()
+    return pd.concat([sub[index].iloc[first].reset_index(drop=True),
+                      agg.reset_index(drop=True)], axis=1)
+
 # Make Tuples from ANN sections
 def MakeList(x):
+    return ReduceList(x.dropna())
+
+def ReduceList(items):
     ret=[]
-    for item in x.dropna():
+    for item in items:
         if type(item)==list:
             ret+=item
         else:
@@ -29,13 +82,14 @@ def merge_rows(sub: pd.DataFrame, index: list) -> list:
     :return: pd.Dataframe
 
     """
-    gb = sub.groupby(([x for x in index]))
-    sub = gb.aggregate(MakeList)
-    return sub.reset_index()
+    return group_rows(sub, index, MakeList, ReduceList)
 
 def MakeUn(x):
+    return ReduceUn(x.dropna())
+
+def ReduceUn(items):
     ret=[]
-    for item in x.dropna():
+    for item in items:
         if type(item)==list:
             ret+=item
         else:
@@ -58,10 +112,65 @@ def merge_rows_unique(sub: pd.DataFrame, index: list) -> list:
     :type index: list
     :return: pd.Dataframe
     """
-    gb = sub.groupby(([x for x in index]))
+    return group_rows(sub, index, MakeUn, ReduceUn)
+
+def MakePartial(x):
+    return list(x.dropna())
+
+# collect rows on an index without reducing them
+def collect_rows(sub: pd.DataFrame, index: list) -> pd.DataFrame:
+    """
+    Groups rows of a dataframe by an index keeping every non-null value of
+    a column as a list. Collected rows can be collected again or reduced
+    with reduce_collected and give the same result as merge_rows on the
+    original rows.
+
+    :param sub: Dataframe to have rows collected
+    :type sub: pd.Dataframe
+    :param index: list of columns to groupby
+    :type index: list
+    :return: pd.Dataframe
+    """
+    return group_rows(sub, index, MakePartial)
+
+def JoinPartial(x):
+    ret=[]
+    for item in x:
+        if type(item)==list:
+            ret+=item
+    return ret
+
+def recollect_rows(sub: pd.DataFrame, index: list) -> pd.DataFrame:
+    """
+    Combines rows produced by collect_rows that share an index.
+
+    :param sub: Dataframe of collected rows
+    :type sub: pd.Dataframe
+    :param index: list of columns to groupby
+    :type index: list
+    :return: pd.Dataframe
+    """
+    dup = sub.duplicated(index, keep=False)
+    if not dup.any():
+        return sub
+    return pd.concat([sub[~dup], group_rows(sub[dup], index, JoinPartial)], ignore_index=True)
+
+def reduce_collected(sub: pd.DataFrame, index: list) -> pd.DataFrame:
+    """
+    Reduces rows produced by collect_rows the same way merge_rows does.
 
-    sub = gb.aggregate(MakeUn)
-    return sub.reset_index()
+    :param sub: Dataframe of collected rows
+    :type sub: pd.Dataframe
+    :param index: list of columns not to be reduced
+    :type index: list
+    :return: pd.Dataframe
+    """
+    sub = sub.copy()
+    for col in sub.columns:
+        if col in index:
+            continue
+        sub[col] = [MakeList(pd.Series(x if type(x)==list else [], dtype=object)) for x in sub[col]]
+    return sub
 
 def form_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Merges rows with same indices")
@@ -69,12 +178,25 @@ def form_parser() -> argparse.ArgumentParser:
     parser.add_argument('-u', '--unique', action="store_true",
                         help="merges uniquely")
     parser.add_argument('-d','--delimiter')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="processes used to parse stdin when it is a file, defaults to the available cpus")
+    parser.add_argument('--filter', default=None,
+                        help="varquery query string, only rows matching it are read")
+    parser.add_argument('-i', '--input', action="append", default=None,
+                        help="jsonl file or directory of them to read instead of stdin, may be repeated")
     parser.add_argument('indices', nargs="+")
     return parser
 
 if __name__=="__main__":
     args=form_parser().parse_args()
-    data=pd.read_json(sys.stdin,orient="records",lines=True)
+    try:
+        if args.input is not None:
+            data=reader.read_inputs(args.input, args.jobs, args.filter)
+        else:
+            data=reader.read_stdin(args.jobs, args.filter)
+    except QueryError as e:
+        print("Error: invalid query,", e)
+        sys.exit(1)
     if args.delimiter:
         delim=args.delimiter
     for x in args.indices:
@@ -0,0 +1,178 @@
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+def read_proc(fn: str) -> dict:
+    """
+    Reads a "key: value" file from /proc/self. Returns an empty dict on
+    systems without procfs.
+    """
+    values = dict()
+    try:
+        with open(os.path.join("/proc/self", fn)) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                values[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return values
+
+def io_counters() -> dict:
+    # rchar/wchar count bytes passed to read and write calls, cached or not
+    counters = read_proc("io")
+    return {"read": int(counters["rchar"]), "written": int(counters["wchar"])} if "rchar" in counters else None
+
+def kb_to_mb(value: str):
+    return int(value.split()[0]) / 1024 if value else None
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak RSS of the process (linux >= 4.0) so the peak of a
+    single stage can be measured.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def maxrss_mb(usage) -> float:
+    return usage.ru_maxrss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+def peak_rss_mb(reset: bool):
+    if reset:
+        return kb_to_mb(read_proc("status").get("VmHWM"))
+    # fall back to the peak of the whole process
+    return maxrss_mb(resource.getrusage(resource.RUSAGE_SELF))
+
+def worker_usage() -> tuple:
+    """
+    Returns the cpu time and the largest peak RSS of the worker processes
+    that have finished and been waited for, i.e. those of a closed
+    ProcessPoolExecutor. Their bytes read and written are added to the
+    counters of /proc/self/io by the kernel at the same point.
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, maxrss_mb(usage)
+
+def shape(df) -> tuple:
+    return (len(df), len(df.columns)) if df is not None else (None, None)
+
+
+class Stage:
+    """
+    Measurements for one stage of a run. Stages are created by
+    Metrics.stage, the caller records what the stage produced with output
+    and output_file.
+    """
+
+    def __init__(self, name: str, df=None):
+        self.name = name
+        self.record = {"stage": name}
+        self.record["rows_in"], self.record["columns_in"] = shape(df)
+        self.files = []
+
+    def output(self, df):
+        self.record["rows_out"], self.record["columns_out"] = shape(df)
+
+    def output_file(self, fn: str):
+        self.files.append(fn)
+
+
+class Metrics:
+    """
+    Collects wall time, cpu time, rows, columns, peak RSS and bytes read
+    and written for every stage of a mucor3 run. cpu time and bytes
+    include worker processes that finished within the stage, peak_rss_mb
+    is the main process only and worker_peak_rss_mb the largest peak of any
+    worker so far, as the kernel keeps no per-stage peak for children.
+
+    Pass an instance to mucor.main to inspect a run from python. callback
+    is called with the record of each stage as it finishes. If
+    profile_stage names a stage it is run under cProfile and the stats are
+    dumped to profile_out.
+
+    :param enabled: when False stages are not measured
+    :type enabled: bool
+    :param callback: function called with each stage record
+    :param profile_stage: name of the stage to profile
+    :type profile_stage: str
+    :param profile_out: cProfile stats file
+    :type profile_out: str
+    """
+
+    def __init__(self, enabled: bool=True, callback=None, profile_stage: str=None, profile_out: str=None):
+        self.enabled = enabled
+        self.callback = callback
+        self.profile_stage = profile_stage
+        self.profile_out = profile_out
+        self.stages = []
+        self.start = (time.perf_counter(), time.process_time(), worker_usage()[0])
+
+    @contextmanager
+    def stage(self, name: str, df=None):
+        """
+        Measures the enclosed block as stage name.
+
+        :param name: stage name
+        :type name: str
+        :param df: input dataframe of the stage
+        :type df: pd.Dataframe
+        """
+        if not self.enabled:
+            yield Stage(name)
+            return
+        stage = Stage(name, df)
+        reset = reset_peak_rss()
+        io = io_counters()
+        profiler = None
+        if name == self.profile_stage:
+            import cProfile
+            profiler = cProfile.Profile()
+        cpu = time.process_time()
+        worker_cpu = worker_usage()[0]
+        wall = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield stage
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record = stage.record
+            record["wall_s"] = time.perf_counter() - wall
+            worker_cpu_end, worker_rss = worker_usage()
+            record["worker_cpu_s"] = worker_cpu_end - worker_cpu
+            record["cpu_s"] = time.process_time() - cpu + record["worker_cpu_s"]
+            record["peak_rss_mb"] = peak_rss_mb(reset)
+            record["worker_peak_rss_mb"] = worker_rss if record["worker_cpu_s"] > 0 else None
+            io_end = io_counters()
+            if io is not None:
+                record["bytes_read"] = io_end["read"] - io["read"]
+                record["bytes_written"] = io_end["written"] - io["written"]
+            if len(stage.files) != 0:
+                record["files"] = {x: os.path.getsize(x) for x in stage.files if os.path.exists(x)}
+            if profiler is not None:
+                profiler.dump_stats(self.profile_out or name + ".prof")
+                record["profile"] = self.profile_out or name + ".prof"
+            self.stages.append(record)
+            if self.callback is not None:
+                self.callback(record)
+
+    def report(self) -> dict:
+        # resetting the peak for each stage also lowers the process peak
+        peaks = [x["peak_rss_mb"] for x in self.stages if x["peak_rss_mb"] is not None]
+        worker_cpu, worker_rss = worker_usage()
+        return {"wall_s": time.perf_counter() - self.start[0],
+                "cpu_s": time.process_time() - self.start[1] + worker_cpu - self.start[2],
+                "peak_rss_mb": max(peaks + [peak_rss_mb(False)]),
+                "worker_peak_rss_mb": worker_rss if worker_cpu > self.start[2] else None,
+                "stages": self.stages}
+
+    def write(self, fn: str):
+        with open(fn, "w") as f:
+            json.dump(self.report(), f, indent=1)
@@ -1,12 +1,24 @@
+from __future__ import annotations
 import mucor.aggregate as aggregate
 import mucor.merge as merge
 import mucor.jsonlcsv as jsonlcsv
+import mucor.jsonlxlsx as jsonlxlsx
+import mucor.update as update
+import mucor.partial as partial
+import mucor.keys as keys
+import mucor.reader as reader
+import mucor.annotation as annotation
+from mucor.metrics import Metrics
 import argparse
 from shutil import copyfile
 import os
 import sys
-import pandas as pd
-import numpy as np
+from mucor.lazy import lazy_import
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+VARIANT_FIELDS=["CHROM", "POS", "REF", "ALT"]
+REQUIRED_FIELDS=["sample"]+VARIANT_FIELDS
 
 # convert arrays to strings and fix excel wrapping issue
 def fix_cells(x):
@@ -20,18 +32,36 @@ def fix_cells(x):
                 new_list.append(str(item))
         ret = ",".join([str(y) for y in np.unique(new_list).tolist()])
     if type(ret) is str:
-        if len(ret) > 32767:
+        if len(ret) > jsonlxlsx.EXCEL_MAX_CHARS:
             print("Warning: row found that was too big to be displayed in excel", file=sys.stderr)
-            ret = ret[0::32767]
+            ret = ret[:jsonlxlsx.EXCEL_MAX_CHARS]
     return ret
 
 def form_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     #default=["ANN_gene_name","EFFECT","INFO_cosmic_ids", "INFO_dbsnp_ids"]
     parser.add_argument("-e","--extra",help="comma delimited list of extra columns to include in pivoted table index",type=str)
-    parser.add_argument("-a","--value",default="FMT.AF", help="Value to be displayed in pivoted table values")
+    parser.add_argument("-a","--value",default="FMT.AF",
+                        help="comma delimited list of values to be displayed in pivoted tables, one table per value")
     parser.add_argument("-m","--merge", action="store_true", help="Merge rows togther to deal with annotation explosion")
-    parser.add_argument("datafile", help="input jsonl data from vcf_atomizer")
+    parser.add_argument("-n","--ann-table", action="store_true",
+                        help="With --merge, merge the INFO.ANN fields once per variant from a table of distinct annotations")
+    parser.add_argument("-x","--xlsx", action="store_true", help="Also write the tables as excel workbooks")
+    parser.add_argument("-u","--update", action="store_true",
+                        help="Add the samples in datafile to the results already in prefix instead of rebuilding them")
+    parser.add_argument("-j","--jobs", type=int, default=None,
+                        help="Number of processes used to parse large jsonl files, defaults to the available cpus")
+    parser.add_argument("--filter", default=None,
+                        help="varquery query string, only rows of datafile matching it are read, "
+                        "i.e. \"FMT.AF > 0.05 & INFO.ANN.effect = (missense_variant | stop_gained)\"")
+    parser.add_argument("--metrics", default=None,
+                        help="Write time, memory, rows and bytes read and written for each stage to this json file")
+    parser.add_argument("--profile-stage", default=None,
+                        help="Run this stage (e.g. merge, pivot, join) under cProfile")
+    parser.add_argument("--profile", default=None,
+                        help="cProfile stats file for --profile-stage, defaults to prefix/STAGE.prof")
+    parser.add_argument("datafile", nargs="+",
+                        help="input jsonl data from vcf_atomizer, or several jsonl files (i.e. one per sample) or directories of them")
     parser.add_argument("prefix", help="directory for output")
     return parser
 
@@ -40,123 +70,517 @@ def write_jsonl(master: pd.DataFrame,fn: str):
     master.to_json(fn,orient="records",lines=True)
 
 
-def main():
-    #parse args
-    args=form_parser().parse_args()
-    if not os.path.exists(args.prefix):
-        os.mkdir(args.prefix)
+def check_query(query: str):
+    if query is None:
+        return
+    from mucor.filter import QueryError, compile_query
+    try:
+        compile_query(query)
+    except QueryError as e:
+        print("Error: invalid query,", e)
+        sys.exit(1)
+
+
+def read_filtered(fn: str, args) -> pd.DataFrame:
+    """
+    Reads the rows of a jsonl file matching --filter.
+    """
+    master = reader.read_jsonl(fn, args.jobs, query=args.filter)
+    if len(master) == 0:
+        print("Error: no rows in {} match --filter {}".format(fn, args.filter))
+        sys.exit(1)
+    return master
+
+
+def read_sorted(args) -> pd.DataFrame:
+    """
+    Reads several atomized jsonl files in place and merges them on the
+    required fields. Each file is expected to be sorted, i.e. one sample in
+    genomic order, so only files that are not are sorted.
+
+    :param args: runtime variables from argparse
+    :type args: argparse.Namespace
+    :return: pd.Dataframe sorted on the required fields
+    """
+    frames = []
+    for fn, frame in zip(args.datafile, reader.read_files(args.datafile, args.jobs, query=args.filter)):
+        if len(frame.columns) == 0:
+            continue
+        missing_fields = set(REQUIRED_FIELDS) - set(frame.columns)
+        if(len(missing_fields)!=0):
+            print("Error: missing column in {} ".format(fn),missing_fields)
+            sys.exit(1)
+        frames.append(frame)
+    if len(frames) == 0:
+        print("Error: no rows in {} match --filter {}".format(",".join(args.datafile), args.filter))
+        sys.exit(1)
+    return keys.merge_frames(frames, REQUIRED_FIELDS)
+
+
+def read_annotated(args) -> tuple:
+    """
+    Reads the atomized jsonl for --ann-table. The annotation columns are
+    split off each chunk of rows as it is parsed (see
+    annotation.AnnotationSplitter), so the rows repeated for every
+    transcript are never held at once. Files are not copied to the prefix
+    and several files are merged like read_sorted.
+
+    :param args: runtime variables from argparse
+    :type args: argparse.Namespace
+    :return: sample-level rows, distinct annotations of each variant and an empty dataframe with all atomized columns
+    """
+    print("importing")
+    splits = []
+    for fn, split in zip(args.datafile, reader.read_files(args.datafile, args.jobs, query=args.filter,
+                                                          split=annotation.AnnotationSplitter())):
+        if split is None:
+            continue
+        missing_fields = set(REQUIRED_FIELDS) - set(split[0].columns)
+        if(len(missing_fields)!=0):
+            print("Error: missing column in {} ".format(fn),missing_fields)
+            sys.exit(1)
+        splits.append(split)
+    if len(splits) == 0:
+        print("Error: no rows in {}".format(",".join(args.datafile)) +
+              ("" if args.filter is None else " match --filter {}".format(args.filter)))
+        sys.exit(1)
+    if len(splits) > 1:
+        rows = keys.merge_frames([x[0] for x in splits], REQUIRED_FIELDS)
+    else:
+        rows = splits[0][0]
+    return annotation.distinct_split(rows,
+                                     pd.concat([x[1] for x in splits], ignore_index=True, sort=False),
+                                     pd.concat([x[2] for x in splits], ignore_index=True, sort=False))
+
+
+def read_master(args) -> pd.DataFrame:
+    """
+    Copies the atomized jsonl to the prefix and reads it. With --filter
+    only the matching rows are read and copied. Several files are not
+    copied but merged as they are read, see read_sorted.
+
+    :param args: runtime variables from argparse
+    :type args: argparse.Namespace
+    :return: pd.Dataframe
+    """
+    if len(args.datafile) > 1:
+        print("importing")
+        return read_sorted(args)
+    datafile = args.datafile[0]
+    if args.filter is not None:
+        print("importing")
+        master = read_filtered(datafile, args)
+        write_jsonl(master, os.path.join(args.prefix,"__master.jsonl"))
+        return master
 
     #take json datafile and copy it
     print("copying data")
-    copyfile(args.datafile,os.path.join(args.prefix,"__master.jsonl"))
+    copyfile(datafile,os.path.join(args.prefix,"__master.jsonl"))
 
     #import jsonl
     print("importing")
-    master=pd.read_json(os.path.join(args.prefix,"__master.jsonl"),orient="records",lines=True)
+    return reader.read_jsonl(os.path.join(args.prefix,"__master.jsonl"),args.jobs)
+
+
+def check_value(master: pd.DataFrame, values: list):
+    for value in values:
+        if(value not in master):
+            print("Error: missing column ",value)
+            sys.exit(0)
+
 
-    required_fields=["sample", "CHROM", "POS", "REF", "ALT"]
-    missing_fields = set(required_fields) - set(master.columns)
+def get_values(value: str) -> list:
+    return list(dict.fromkeys(value.split(",")))
+
+
+def table_names(values: list) -> dict:
+    """
+    Names the pivoted table of each value. A single value is written to
+    AF.tsv as before, otherwise tables are named after the last part of the
+    value, i.e. FMT.DP to DP.tsv, or the whole value if that is ambiguous.
+
+    :param values: pivoted values
+    :type values: list
+    :return: dict of value to table name
+    """
+    if len(values) == 1:
+        return {values[0]: "AF"}
+    short = [x.split(".")[-1] for x in values]
+    return {x: (y if short.count(y) == 1 else x) for x, y in zip(values, short)}
+
+
+def prepare_master(master: pd.DataFrame, extra, presorted: bool=False, atomized: pd.DataFrame=None):
+    """
+    Validates the atomized data and adds the derived EFFECT and Total_depth
+    columns. Rows are returned sorted on the required fields.
+
+    :param master: atomized data
+    :type master: pd.Dataframe
+    :param extra: comma delimited list of extra columns or None
+    :type extra: str
+    :param presorted: master is already sorted on the required fields
+    :type presorted: bool
+    :param atomized: with --ann-table, an empty dataframe with all atomized columns, the derived columns are added to it
+    :type atomized: pd.Dataframe
+    :return: master dataframe, set of samples and list of extra columns
+    """
+    missing_fields = set(REQUIRED_FIELDS) - set(master.columns)
     if(len(missing_fields)!=0):
         print("Error: missing column ",missing_fields)
         sys.exit(0)
 
-    if(args.value not in master):
-        print("Error: missing column ",args.value)
-        sys.exit(0)
-
-    #create EFFECT column
-    if("INFO.ANN.hgvs_p" in master):
-        master["EFFECT"]=master["INFO.ANN.hgvs_p"]
-        master["EFFECT"].fillna(master["INFO.ANN.effect"],inplace=True)
+    annotation.add_effect(master)
+    if atomized is not None:
+        annotation.add_effect(atomized)
 
     #create Total Depth column
     if(("Ref_Depth" in master) and ("Alt_depths" in master)):
         master["Total_depth"]=master["Ref_Depth"]+master["Alt_depths"].apply(sum)
+        if atomized is not None:
+            atomized["Total_depth"]=None
     samples=set(master["sample"])
 
+    extra_fields=get_extra_fields(master if atomized is None else atomized, extra)
+
+    if not presorted:
+        print("sorting")
+    return sort_master(master, extra_fields, presorted), samples, extra_fields
+
+
+def get_extra_fields(master: pd.DataFrame, extra) -> list:
     extra_fields=[]
-    if args.extra is not None:
-        missing_fields = set(args.extra.split(",")) - set(master.columns)
+    if extra is not None:
+        missing_fields = set(extra.split(",")) - set(master.columns)
         if(len(missing_fields)!=0):
             print("Warning: missing column(s) ",missing_fields)
 
-        extra_fields=[x for x in args.extra.split(",") if x in list(master)]
+        extra_fields=[x for x in extra.split(",") if x in list(master)]
+    return extra_fields
+
 
-    print("sorting")
-    master.set_index(required_fields, inplace=True)
-    cols = list(master)
+def master_columns(columns: list, extra_fields: list) -> list:
+    # the required and then the extra columns first
+    cols = [x for x in columns if x not in REQUIRED_FIELDS]
     for x in extra_fields[::-1]:
-        cols.insert(0, cols.pop(cols.index(x)))
-    master = master.loc[:, cols]
-    master.sort_index(inplace=True)
-    master.reset_index(inplace=True)
+        if x in cols:
+            cols.insert(0, cols.pop(cols.index(x)))
+    return REQUIRED_FIELDS+cols
 
+
+def sort_master(master: pd.DataFrame, extra_fields: list, presorted: bool=False) -> pd.DataFrame:
+    """
+    Sorts master on the required fields, CHROM in karyotype order, and
+    moves the required and then the extra columns to the front. A presorted
+    master only has its columns moved.
+    """
+    order = slice(None) if presorted else keys.sort_order(master, REQUIRED_FIELDS)
+    return master.iloc[order, master.columns.get_indexer(master_columns(list(master), extra_fields))].reset_index(drop=True)
+
+
+def merge_master(master: pd.DataFrame, args, annotations: pd.DataFrame=None, columns: list=None) -> tuple:
+    """
+    Produces the per-sample rows used for every report, merging rows that
+    share a variant and sample when --merge is set. With --ann-table the
+    merged annotations of each variant are returned as well. Cells still
+    have to be fixed with fix_cells.
+
+    :param master: sorted master dataframe
+    :type master: pd.Dataframe
+    :param args: runtime variables from argparse
+    :type args: argparse.Namespace
+    :param annotations: with --ann-table, the annotations split off master
+    :type annotations: pd.Dataframe
+    :param columns: with --ann-table, the column order of the merged rows
+    :type columns: list
+    :return: pd.Dataframe and the annotation pd.Dataframe or None
+    """
     merged = master
-    condensed = master
+    if args.merge and args.ann_table:
+        print("merging")
+        merged, annotations = annotation.merge_annotated(master, annotations, columns)
+        write_jsonl(merged,os.path.join(args.prefix,"__merge_sample.jsonl"))
+        write_jsonl(annotations,os.path.join(args.prefix,"__annotations.jsonl"))
+
+        #import merged datasets
+        merged=reader.read_jsonl(os.path.join(args.prefix,"__merge_sample.jsonl"),args.jobs)
+        annotations=reader.read_jsonl(os.path.join(args.prefix,"__annotations.jsonl"),args.jobs)
+        return merged, annotations
     if args.merge:
         print("merging")
         #write the merged datasets - merged on CHROM POS REF ALT sample to remove duplicate entrys related to alternate annotations
-        write_jsonl(merge.merge_rows(master,required_fields),os.path.join(args.prefix,"__merge_sample.jsonl"))
-        write_jsonl(merge.merge_rows_unique(master,required_fields),os.path.join(args.prefix,"__merge_sample_u.jsonl"))
+        write_jsonl(merge.merge_rows(master,REQUIRED_FIELDS),os.path.join(args.prefix,"__merge_sample.jsonl"))
+        write_jsonl(merge.merge_rows_unique(master,REQUIRED_FIELDS),os.path.join(args.prefix,"__merge_sample_u.jsonl"))
 
         #import merged dataset
-        merged=pd.read_json(os.path.join(args.prefix,"__merge_sample.jsonl"),orient="records",lines=True)
-    merged = merged.applymap(fix_cells)
+        merged=reader.read_jsonl(os.path.join(args.prefix,"__merge_sample.jsonl"),args.jobs)
+    return merged, None
+
+
+def pivot_samples(merged: pd.DataFrame, values: list, samples) -> dict:
+    """
+    Pivots each value by sample for every variant. Variants and samples
+    are factorized once for all values. Samples with no value for any
+    variant are added back as empty columns.
+
+    :param merged: per-sample rows
+    :type merged: pd.Dataframe
+    :param values: columns to display in the pivoted tables
+    :type values: list
+    :param samples: all samples in the dataset
+    :type samples: iterable
+    :return: dict of value to pd.Dataframe
+    """
+    pivots=aggregate.pivot_values(merged,
+                    VARIANT_FIELDS,#["ANN_gene_name","EFFECT","INFO_cosmic_ids", "INFO_dbsnp_ids"],
+                    ["sample"],values,".")
+
+    #if any samples removed add them back
+    for pivot in pivots.values():
+        for x in (set(samples)-set(pivot.columns)):
+            pivot[x]="."
+            print(x)
+    return pivots
+
+
+def write_reports(master: pd.DataFrame, merged: pd.DataFrame, condensed: pd.DataFrame,
+                  pivots: dict, extra_fields: list, args, metrics: Metrics=None):
+    """
+    Writes master.tsv, Variants.tsv and a pivoted table per value (see
+    table_names) to the prefix, along with excel versions of them when
+    --xlsx is set. The extra columns are gathered once for all tables.
+    """
+    if metrics is None:
+        metrics = Metrics(enabled=False)
+
+    def write_table(df: pd.DataFrame, index: list, name: str, numeric: list=[]):
+        fn = os.path.join(args.prefix, name + ".tsv")
+        with metrics.stage("write " + name + ".tsv", df) as stage:
+            jsonlcsv.jsonl2tsv(df, index, fn)
+            stage.output_file(fn)
+        if args.xlsx:
+            fn = os.path.join(args.prefix, name + ".xlsx")
+            with metrics.stage("write " + name + ".xlsx", df) as stage:
+                jsonlxlsx.jsonl2xlsx(df, index, fn, name, numeric)
+                stage.output_file(fn)
+
     #write master tsv
-    jsonlcsv.jsonl2tsv(
-        merged,
-        required_fields,
-        os.path.join(args.prefix,"master.tsv")
-    )
-    condensed=merge.merge_rows_unique(merged,["CHROM","POS","REF","ALT"])
+    write_table(merged, REQUIRED_FIELDS, "master")
     #write Variants tsv
-    jsonlcsv.jsonl2tsv(
-        condensed,
-        required_fields,
-        os.path.join(args.prefix,"Variants.tsv")
-    )
+    write_table(condensed, REQUIRED_FIELDS, "Variants")
 
-    #load uniquely merged dataset
-    #merged=pd.read_json(os.path.join(args.prefix,"__merge_sample_u.jsonl"),orient="records",lines=True)
+    tables = dict()
+    with metrics.stage("join", master) as stage:
+        #extra columns come from the first row of each variant
+        source = condensed if args.merge else master
+        lookup=aggregate.first_rows(source,VARIANT_FIELDS)
+        for value, pivot in pivots.items():
+            pivot=aggregate.gather_columns(source,lookup,pivot,VARIANT_FIELDS,extra_fields)
+            pivot.set_index(VARIANT_FIELDS,inplace=True)
 
-    #pivot AF
-    pivot=aggregate.pivot(merged,
-                    ["CHROM", "POS", "REF", "ALT"],#["ANN_gene_name","EFFECT","INFO_cosmic_ids", "INFO_dbsnp_ids"],
-                    ["sample"],[args.value],"string_agg",".")
+            cols = list(pivot)
+            for x in extra_fields[::-1]:
+                cols.insert(0, cols.pop(cols.index(x)))
+            pivot = pivot.loc[:, cols]
 
-    #if any samples removed add them back
-    for x in (samples-set(pivot.columns)):
-        pivot[x]="."
-        print(x)
-    if args.merge:
-        pivot=aggregate.join_columns(condensed,pivot,["CHROM", "POS", "REF", "ALT"],
-                                     extra_fields)
+            pivot.reset_index(inplace=True)
+            tables[value] = pivot
+        stage.output(pivot)
+
+    with metrics.stage("metrics", pivot) as stage:
+        for value, pivot in tables.items():
+            pivot=aggregate.add_result_metrics(pivot,VARIANT_FIELDS+extra_fields)
+            tables[value] = pivot.applymap(fix_cells)
+        stage.output(tables[value])
+
+    #write pivot tables
+    #sample values and metrics are written as numbers in excel
+    names = table_names(list(tables))
+    for value, pivot in tables.items():
+        numeric=list(pivot.columns[len(VARIANT_FIELDS)+len(extra_fields):])
+        write_table(pivot, VARIANT_FIELDS, names[value], numeric)
+
+
+def form_partial_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="mucor3 partial",
+                                     description="Create a partial result for a subset of samples or files. "
+                                     "Partial results are combined into tables with mucor3 combine.")
+    parser.add_argument("datafile", help="input jsonl data from vcf_atomizer")
+    parser.add_argument("output", help="partial result file (jsonl)")
+    parser.add_argument("-j","--jobs", type=int, default=None,
+                        help="Number of processes used to parse large jsonl files, defaults to the available cpus")
+    parser.add_argument("--filter", default=None,
+                        help="varquery query string, only rows of datafile matching it are read")
+    return parser
+
+
+def form_combine_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="mucor3 combine",
+                                     description="Combine partial results from mucor3 partial into tables. "
+                                     "Rows are merged as with mucor3 --merge.")
+    parser.add_argument("-e","--extra",help="comma delimited list of extra columns to include in pivoted table index",type=str)
+    parser.add_argument("-a","--value",default="FMT.AF",
+                        help="comma delimited list of values to be displayed in pivoted tables, one table per value")
+    parser.add_argument("-x","--xlsx", action="store_true", help="Also write the tables as excel workbooks")
+    parser.add_argument("prefix", help="directory for output")
+    parser.add_argument("partials", nargs="+",
+                        help="partial results from mucor3 partial, in input order unless each holds whole samples")
+    return parser
+
+
+def form_diff_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="mucor3 diff",
+                                     description="Compare the variants and sample-variants of two atomized jsonl files. "
+                                     "Writes the lost, gained and retained sets, before and after an optional filter.")
+    parser.add_argument("-o","--output",default=".", help="directory for output")
+    parser.add_argument("a", help="first jsonl data from vcf_atomizer, - for stdin")
+    parser.add_argument("b", help="second jsonl data from vcf_atomizer")
+    parser.add_argument("query", nargs="?", default=None, help="varquery query string used to filter both inputs")
+    return parser
+
+
+def partial_main(argv: list):
+    args=form_partial_parser().parse_args(argv)
+    check_query(args.filter)
+    print("importing")
+    if args.filter is not None:
+        master=read_filtered(args.datafile,args)
     else:
-        pivot=aggregate.join_columns_unmerged(master,pivot,
-                                              ["CHROM", "POS", "REF", "ALT"],
-                                                extra_fields)
-    pivot.set_index(["CHROM", "POS", "REF", "ALT"],inplace=True)
+        master=reader.read_jsonl(args.datafile,args.jobs)
+    master, samples, extra_fields = prepare_master(master, None)
+    print("collecting")
+    partial.write_partial(partial.make_partial(master), args.output)
 
-    cols = list(pivot)
-    for x in extra_fields[::-1]:
-        cols.insert(0, cols.pop(cols.index(x)))
-    pivot = pivot.loc[:, cols]
 
-    pivot.reset_index(inplace=True)
-    pivot=aggregate.add_result_metrics(pivot,["CHROM", "POS", "REF", "ALT"]+extra_fields)
-    pivot = pivot.applymap(fix_cells)
+def combine_main(argv: list):
+    args=form_combine_parser().parse_args(argv)
+    args.merge=True
+    if not os.path.exists(args.prefix):
+        os.mkdir(args.prefix)
 
-    #write AF pivot table
-    jsonlcsv.jsonl2tsv(pivot,
-                       ["CHROM", "POS", "REF", "ALT"],
-                       os.path.join(args.prefix,"AF.tsv")
-    )
+    print("importing")
+    combined=partial.combine_partials([partial.read_partial(x) for x in args.partials])
+    values=get_values(args.value)
+    check_value(combined, values)
+    samples=set(combined["sample"])
 
+    print("merging")
+    merged=partial.finish_partial(combined)
+    extra_fields=get_extra_fields(merged, args.extra)
+    merged=sort_master(merged, extra_fields).applymap(fix_cells)
 
+    condensed=merge.merge_rows_unique(merged,VARIANT_FIELDS)
+    pivots=pivot_samples(merged, values, samples)
+    write_reports(merged, merged, condensed, pivots, extra_fields, args)
+
+
+def diff_main(argv: list):
+    import mucor.diff as diff
+    from mucor.filter import QueryError
+    args=form_diff_parser().parse_args(argv)
+    if not os.path.exists(args.output):
+        os.mkdir(args.output)
+    try:
+        print(diff.diff(args.a, args.b, args.output, args.query), file=sys.stderr, end="")
+    except QueryError as e:
+        print("Error: invalid query,", e)
+        sys.exit(1)
 
-if __name__=="__main__":
-    main()
 
+def main(metrics: Metrics=None):
+    """
+    Runs mucor3 with the arguments in sys.argv.
+
+    :param metrics: collects per-stage measurements of the run, see mucor.metrics.Metrics
+    :type metrics: Metrics
+    """
+    if len(sys.argv) > 1 and sys.argv[1] == "partial":
+        partial_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "combine":
+        combine_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "diff":
+        diff_main(sys.argv[2:])
+        return
+
+    #parse args
+    args=form_parser().parse_args()
+    if args.ann_table and not args.merge:
+        print("Error: --ann-table requires --merge")
+        sys.exit(1)
+    check_query(args.filter)
+    args.datafile = reader.input_files(args.datafile)
+    if len(args.datafile) == 0:
+        print("Error: no jsonl files found")
+        sys.exit(1)
+    if not os.path.exists(args.prefix):
+        os.mkdir(args.prefix)
+    if metrics is None:
+        profile = args.profile
+        if args.profile_stage is not None and profile is None:
+            profile = os.path.join(args.prefix, args.profile_stage + ".prof")
+        metrics = Metrics(enabled=args.metrics is not None or args.profile_stage is not None,
+                          profile_stage=args.profile_stage, profile_out=profile)
 
+    state = None
+    if args.update:
+        with metrics.stage("load_state"):
+            state = update.load_state(args.prefix)
+            if state is not None:
+                update.check_state(state, args)
 
+    with metrics.stage("ingest") as stage:
+        if args.ann_table:
+            master, annotations, atomized = read_annotated(args)
+        else:
+            master, annotations, atomized = read_master(args), None, None
+        stage.output(master)
+    values = get_values(args.value)
+    check_value(master if atomized is None else atomized, values)
+    with metrics.stage("sort", master) as stage:
+        master, samples, extra_fields = prepare_master(master, args.extra, len(args.datafile) > 1, atomized)
+        stage.output(master)
+    with metrics.stage("merge", master) as stage:
+        columns = None if atomized is None else master_columns(list(atomized), extra_fields)
+        merged, annotations = merge_master(master, args, annotations, columns)
+        stage.output(merged)
+    with metrics.stage("fix_cells", merged) as stage:
+        merged = merged.applymap(fix_cells)
+        if annotations is not None:
+            annotations = annotations.applymap(fix_cells)
+        stage.output(merged)
 
+    if state is not None:
+        print("updating")
+        with metrics.stage("update", merged) as stage:
+            merged, condensed, pivots = update.update_state(state, merged, samples, values)
+            master = merged
+            stage.output(condensed)
+    else:
+        with metrics.stage("condense", merged) as stage:
+            if annotations is not None:
+                condensed=annotation.condense(merged,annotations)
+            else:
+                condensed=merge.merge_rows_unique(merged,VARIANT_FIELDS)
+            stage.output(condensed)
+        #load uniquely merged dataset
+        #merged=pd.read_json(os.path.join(args.prefix,"__merge_sample_u.jsonl"),orient="records",lines=True)
+
+        #pivot AF and any other values
+        with metrics.stage("pivot", merged) as stage:
+            pivots=pivot_samples(merged, values, samples)
+            stage.output(pivots[values[0]])
+
+    if args.update:
+        with metrics.stage("save_state"):
+            update.save_state(args.prefix, merged, condensed, pivots, args)
+
+    write_reports(master, merged, condensed, pivots, extra_fields, args, metrics)
+
+    if args.metrics is not None:
+        metrics.write(args.metrics)
+
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,58 @@
+from __future__ import annotations
+from mucor.lazy import lazy_import
+pd = lazy_import("pandas")
+import mucor.merge as merge
+
+VARIANT_FIELDS=["CHROM", "POS", "REF", "ALT"]
+REQUIRED_FIELDS=["sample"]+VARIANT_FIELDS
+
+# A partial result holds one row per variant and sample, i.e. one sparse
+# cell of the pivoted table, with every other column collected into a list
+# of the values seen for that cell. Collected lists are joined in the order
+# the partials are combined, so partials must either hold whole samples,
+# then they can be combined in any order, or be consecutive pieces of the
+# input combined in input order to match mucor3 --merge.
+
+
+def make_partial(master: pd.DataFrame) -> pd.DataFrame:
+    """
+    Collects atomized rows into a partial result.
+
+    :param master: atomized data
+    :type master: pd.Dataframe
+    :return: pd.Dataframe
+    """
+    return merge.collect_rows(master, REQUIRED_FIELDS)
+
+
+def write_partial(partial: pd.DataFrame, fn: str):
+    partial.to_json(fn,orient="records",lines=True)
+
+
+def read_partial(fn: str) -> pd.DataFrame:
+    # keep collected values exactly as they were written
+    return pd.read_json(fn,orient="records",lines=True,dtype=False)
+
+
+def combine_partials(partials: list) -> pd.DataFrame:
+    """
+    Combines partial results into one partial result. Values collected
+    for the same variant and sample are joined in the order of partials.
+
+    :param partials: partial results
+    :type partials: list
+    :return: pd.Dataframe
+    """
+    combined = pd.concat(partials, ignore_index=True)
+    return merge.recollect_rows(combined, REQUIRED_FIELDS)
+
+
+def finish_partial(partial: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduces a partial result to the rows mucor3 --merge gets from merge_rows.
+
+    :param partial: partial result
+    :type partial: pd.Dataframe
+    :return: pd.Dataframe
+    """
+    return merge.reduce_collected(partial, REQUIRED_FIELDS)
@@ -0,0 +1,267 @@
+from __future__ import annotations
+import io
+import json
+import mmap
+import os
+import stat
+import sys
+try:
+    from mucor.lazy import lazy_import
+    from mucor.filter import compile_query
+except ImportError:
+    # run as a script from this directory
+    from lazy import lazy_import
+    from filter import compile_query
+pd = lazy_import("pandas")
+
+# pd.read_json parses jsonl on a single core. Large files are split into
+# byte ranges that end on a newline; each range is read and parsed to
+# a dataframe in a worker process and the frames are concatenated in file
+# order. Smaller files, or a single job, are read with one pd.read_json call.
+#
+# A varquery filter (see mucor.filter) and a list of columns can be pushed
+# down into the reader. Each line is then tested as it is read and only the
+# matching lines, reduced to the columns, are handed to pandas.
+#
+# A split function can also be given. Lines are then parsed CHUNK_ROWS at a
+# time and each chunk is passed to split, which returns a tuple of smaller
+# dataframes, so a file is never held as one dataframe. The tuples are
+# concatenated position by position.
+
+# ranges smaller than this are not worth a worker process
+MIN_RANGE_BYTES = 32 * 1024 * 1024
+# rows parsed at a time when a split is given
+CHUNK_ROWS = 10000
+
+
+def line_ranges(fn: str, parts: int, start: int=0) -> list:
+    """
+    Splits a file into at most parts byte ranges ending on a newline.
+
+    :param fn: file name
+    :type fn: str
+    :param parts: number of ranges
+    :type parts: int
+    :param start: offset to start from
+    :type start: int
+    :return: list of (start, end) tuples
+    """
+    with open(fn, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= start:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ranges = []
+            step = max((size - start) // parts, 1)
+            while start < size:
+                end = mm.find(b"\n", min(start + step, size - 1))
+                end = size if end == -1 else end + 1
+                ranges.append((start, end))
+                start = end
+            return ranges
+
+
+def select_lines(lines, query: str=None, columns: list=None):
+    """
+    Yields the jsonl lines matching a query, reduced to columns.
+
+    :param lines: iterable of jsonl lines as bytes
+    :param query: varquery query string, see mucor.filter
+    :type query: str
+    :param columns: keys to keep, all if None
+    :type columns: list
+    """
+    match = compile_query(query) if query is not None else None
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if match is not None and not match(record):
+            continue
+        if columns is not None:
+            yield json.dumps({x: record[x] for x in columns if x in record}).encode() + b"\n"
+        else:
+            yield line if line.endswith(b"\n") else line + b"\n"
+
+
+def split_chunks(source, split) -> list:
+    # source is a file name or a file object
+    with pd.read_json(source, orient="records", lines=True, chunksize=CHUNK_ROWS) as chunks:
+        return [split(x) for x in chunks]
+
+
+def concat_splits(splits: list):
+    """
+    Concatenates the tuples returned by a split position by position.
+    Returns None if there are none.
+    """
+    if len(splits) == 0:
+        return None
+    return tuple(pd.concat([x[i] for x in splits], ignore_index=True, sort=False) for i in range(len(splits[0])))
+
+
+def parse_bytes(data: bytes, split=None):
+    if not data.strip():
+        return pd.DataFrame() if split is None else []
+    if split is not None:
+        return split_chunks(io.BytesIO(data), split)
+    return pd.read_json(io.BytesIO(data), orient="records", lines=True)
+
+
+def parse_range(fn: str, start: int, end: int, query: str=None, columns: list=None, split=None):
+    # returns a dataframe, or the list of tuples from split
+    if end <= start:
+        return pd.DataFrame() if split is None else []
+    # read rather than mapped so the bytes show up in the io counters of --metrics
+    with open(fn, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    if query is not None or columns is not None:
+        data = b"".join(select_lines(io.BytesIO(data), query, columns))
+    return parse_bytes(data, split)
+
+
+def default_jobs() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def read_jsonl(fn: str, jobs: int=None, start: int=0, query: str=None, columns: list=None, split=None):
+    """
+    Reads a jsonl file into a dataframe, parsing large files in parallel.
+    Gives the same rows, in the same order, and columns as
+    pd.read_json(fn, orient="records", lines=True); columns whose type
+    differs between ranges are upcast when the ranges are concatenated.
+    With a query or columns, lines not matching the query are skipped and
+    other columns dropped before the lines are parsed into a dataframe.
+    With a split, the tuples split returns for each chunk of the file are
+    concatenated and returned instead (None for an empty file). Each worker
+    process calls its own copy of split.
+
+    :param fn: jsonl file
+    :type fn: str
+    :param jobs: number of worker processes, defaults to the available cpus
+    :type jobs: int
+    :param start: byte offset the data starts at
+    :type start: int
+    :param query: varquery query string, see mucor.filter
+    :type query: str
+    :param columns: columns to keep, all if None
+    :type columns: list
+    :param split: function taking a parsed dataframe and returning a tuple of dataframes
+    :return: pd.Dataframe, or a tuple of pd.Dataframe with split
+    """
+    if jobs is None:
+        jobs = default_jobs()
+    if query is not None:
+        # raise a QueryError here rather than in every worker
+        compile_query(query)
+    size = os.path.getsize(fn) - start
+    if size <= 0:
+        return pd.DataFrame() if split is None else None
+    parts = min(jobs, size // MIN_RANGE_BYTES)
+    if parts <= 1:
+        if start == 0 and query is None and columns is None:
+            if split is not None:
+                return concat_splits(split_chunks(fn, split))
+            return pd.read_json(fn, orient="records", lines=True)
+        if split is not None:
+            return concat_splits(parse_range(fn, start, start + size, query, columns, split))
+        return parse_range(fn, start, start + size, query, columns)
+    # multiprocessing is only imported when it is used
+    from concurrent.futures import ProcessPoolExecutor
+    ranges = line_ranges(fn, parts, start)
+    with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+        frames = list(pool.map(parse_range, [fn] * len(ranges), [x[0] for x in ranges], [x[1] for x in ranges],
+                               [query] * len(ranges), [columns] * len(ranges), [split] * len(ranges)))
+    if split is not None:
+        return concat_splits([x for splits in frames for x in splits])
+    frames = [x for x in frames if len(x.columns) != 0]
+    if len(frames) == 0:
+        return pd.DataFrame()
+    # columns only seen in later ranges are placed as they would be by a single read
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def read_stdin(jobs: int=None, query: str=None, columns: list=None) -> pd.DataFrame:
+    """
+    Reads jsonl from stdin. When stdin is redirected from a file it is
+    read in parallel like read_jsonl, otherwise with pd.read_json.
+
+    :param jobs: number of worker processes, defaults to the available cpus
+    :type jobs: int
+    :param query: varquery query string, see mucor.filter
+    :type query: str
+    :param columns: columns to keep, all if None
+    :type columns: list
+    :return: pd.Dataframe
+    """
+    try:
+        fd = sys.stdin.fileno()
+        regular = stat.S_ISREG(os.fstat(fd).st_mode)
+    except (AttributeError, OSError, ValueError):
+        regular = False
+    if not regular:
+        if query is None and columns is None:
+            return pd.read_json(sys.stdin, orient="records", lines=True)
+        return parse_bytes(b"".join(select_lines(sys.stdin.buffer, query, columns)))
+    return read_jsonl("/dev/fd/{}".format(fd), jobs, os.lseek(fd, 0, os.SEEK_CUR), query, columns)
+
+
+def input_files(paths: list) -> list:
+    """
+    Expands directories to the jsonl files in them, in name order.
+
+    :param paths: jsonl files and directories
+    :type paths: list
+    :return: list of file names
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, x) for x in os.listdir(path) if x.endswith(".jsonl"))
+        else:
+            files.append(path)
+    return files
+
+
+def read_files(files: list, jobs: int=None, query: str=None, columns: list=None, split=None) -> list:
+    """
+    Reads several jsonl files, i.e. one per sample, into one dataframe per
+    file, in the order given. With more than one job the files are read in
+    worker processes, one file per process.
+
+    :param files: jsonl files
+    :type files: list
+    :param jobs: number of worker processes, defaults to the available cpus
+    :type jobs: int
+    :param query: varquery query string, see mucor.filter
+    :type query: str
+    :param columns: columns to keep, all if None
+    :type columns: list
+    :param split: see read_jsonl
+    :return: list of pd.Dataframe, or of tuples with split
+    """
+    if jobs is None:
+        jobs = default_jobs()
+    if query is not None:
+        compile_query(query)
+    if jobs <= 1 or len(files) <= 1:
+        return [read_jsonl(x, jobs, query=query, columns=columns, split=split) for x in files]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as pool:
+        return list(pool.map(read_jsonl, files, [1] * len(files), [0] * len(files),
+                             [query] * len(files), [columns] * len(files), [split] * len(files)))
+
+
+def read_inputs(paths: list, jobs: int=None, query: str=None, columns: list=None) -> pd.DataFrame:
+    """
+    Reads jsonl files and directories of them into one dataframe, as if
+    they had been concatenated into one file first.
+    """
+    frames = [x for x in read_files(input_files(paths), jobs, query, columns) if len(x.columns) != 0]
+    if len(frames) == 0:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True, sort=False)
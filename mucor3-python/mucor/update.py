@@ -0,0 +1,146 @@
+from __future__ import annotations
+import json
+import os
+import sys
+from mucor.lazy import lazy_import
+pd = lazy_import("pandas")
+import mucor.aggregate as aggregate
+import mucor.merge as merge
+import mucor.keys as keys
+
+VARIANT_FIELDS=["CHROM", "POS", "REF", "ALT"]
+REQUIRED_FIELDS=["sample"]+VARIANT_FIELDS
+
+# files making up the persistent state kept in an output prefix
+STATE_DIR="__state"
+STATE_META="state.json"
+STATE_MERGED="merged.jsonl"
+STATE_CONDENSED="variants.jsonl"
+STATE_PIVOT="pivot.jsonl"
+
+
+def pivot_file(i: int) -> str:
+    # the first value keeps the name used before several values were allowed
+    return STATE_PIVOT if i==0 else "pivot.{}.jsonl".format(i)
+
+
+def state_values(state: dict) -> list:
+    return state["value"].split(",")
+
+
+def read_state_jsonl(fn: str) -> pd.DataFrame:
+    # dtype inference would turn pivot cells like "12" back into numbers
+    return pd.read_json(fn,orient="records",lines=True,dtype=False)
+
+
+def load_state(prefix: str):
+    """
+    Loads the per-variant state saved by a previous --update run.
+
+    :param prefix: output directory of the previous run
+    :type prefix: str
+    :return: dict of state tables and settings or None if prefix has no state
+    """
+    path=os.path.join(prefix,STATE_DIR)
+    if not os.path.exists(os.path.join(path,STATE_META)):
+        return None
+    print("loading state")
+    with open(os.path.join(path,STATE_META),"r") as f:
+        state=json.load(f)
+    state["merged"]=read_state_jsonl(os.path.join(path,STATE_MERGED))
+    state["condensed"]=read_state_jsonl(os.path.join(path,STATE_CONDENSED))
+    state["pivots"]=dict()
+    for i,value in enumerate(state_values(state)):
+        pivot=read_state_jsonl(os.path.join(path,pivot_file(i)))
+        # keep sample columns in the order they were written
+        state["pivots"][value]=pivot.reindex(columns=VARIANT_FIELDS+state["samples"])
+    return state
+
+
+def check_state(state: dict, args):
+    """
+    Exits if the state in prefix was built with different settings than
+    the current run as the reports could not be combined.
+    """
+    if state_values(state)!=list(dict.fromkeys(args.value.split(","))) or state["merge"]!=args.merge:
+        print("Error: results in {} were built with --value {} and {}--merge, rerun without --update"
+              .format(args.prefix,state["value"],"" if state["merge"] else "no "))
+        sys.exit(1)
+
+
+def save_state(prefix: str, merged: pd.DataFrame, condensed: pd.DataFrame,
+               pivots: dict, args):
+    """
+    Saves the per-sample rows, per-variant rows and the pivoted values so a
+    later --update run only has to process new samples.
+    """
+    path=os.path.join(prefix,STATE_DIR)
+    if not os.path.exists(path):
+        os.mkdir(path)
+    merged.to_json(os.path.join(path,STATE_MERGED),orient="records",lines=True)
+    condensed.to_json(os.path.join(path,STATE_CONDENSED),orient="records",lines=True)
+    for i,pivot in enumerate(pivots.values()):
+        pivot.to_json(os.path.join(path,pivot_file(i)),orient="records",lines=True)
+    # the meta file is written last so an interrupted save is not picked up
+    with open(os.path.join(path,STATE_META),"w") as f:
+        json.dump({"samples":[x for x in pivot.columns if x not in VARIANT_FIELDS],
+                   "value":",".join(pivots),
+                   "merge":args.merge},f)
+
+
+def variant_index(df: pd.DataFrame) -> pd.MultiIndex:
+    return pd.MultiIndex.from_frame(df[VARIANT_FIELDS])
+
+
+def update_state(state: dict, merged: pd.DataFrame, samples: set, values: list):
+    """
+    Merges the per-sample rows of a new batch into a saved state. Samples
+    already present in the state are replaced by the new batch. Only
+    variants seen in the new batch or carried by a replaced sample are
+    re-condensed and re-pivoted; new samples are appended as columns.
+
+    :param state: state from load_state
+    :type state: dict
+    :param merged: per-sample rows of the new batch
+    :type merged: pd.Dataframe
+    :param samples: samples in the new batch
+    :type samples: set
+    :param values: columns displayed in the pivoted tables
+    :type values: list
+    :return: per-sample rows, per-variant rows and dict of pivots of the combined dataset
+    """
+    old_samples=state["samples"]
+    replaced=set(samples) & set(old_samples)
+    if len(replaced)!=0:
+        print("Warning: replacing previously added sample(s) ",replaced)
+
+    old_merged=state["merged"]
+    stale=old_merged["sample"].isin(replaced)
+    touched=variant_index(pd.concat([old_merged.loc[stale,VARIANT_FIELDS],
+                                     merged[VARIANT_FIELDS]]).drop_duplicates())
+
+    # the state is kept sorted, only the new batch is sorted before merging
+    rows=keys.merge_frames([old_merged[~stale],merged],REQUIRED_FIELDS)
+    affected=rows[variant_index(rows).isin(touched)]
+
+    # re-condense only the affected variants
+    condensed=state["condensed"]
+    condensed=keys.merge_frames([condensed[~variant_index(condensed).isin(touched)],
+                                 merge.merge_rows_unique(affected,VARIANT_FIELDS)],VARIANT_FIELDS)
+
+    # existing sample columns keep their position, new samples are appended
+    all_samples=old_samples+sorted(set(samples)-set(old_samples))
+    columns=VARIANT_FIELDS+all_samples
+
+    fresh=dict()
+    if len(affected)!=0:
+        fresh=aggregate.pivot_values(affected,VARIANT_FIELDS,["sample"],values,".")
+    pivots=dict()
+    for value in values:
+        pivot=state["pivots"][value]
+        pivot=pivot[~variant_index(pivot).isin(touched)].reindex(columns=columns,fill_value=".").reset_index(drop=True)
+        if value in fresh:
+            pivot=keys.merge_frames([pivot,fresh[value].reindex(columns=columns,fill_value=".")],VARIANT_FIELDS)
+        pivot.columns.name=None
+        pivots[value]=pivot
+    return rows, condensed, pivots
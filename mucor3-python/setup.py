@@ -26,6 +26,7 @@ setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=["pandas"],
+    extras_require={"xlsx": ["openpyxl"]},
     entry_points={
         "console_scripts": [
             "mucor3 = mucor.mucor:main",
@@ -6,10 +6,12 @@ as two ID seperated by a ';'.
 
 Author: Kekananen, Charles Gregory
 """""
+from __future__ import annotations
 import sys
-import pandas as pd
 import argparse as ap
-import numpy as np
+from mucor.lazy import lazy_import
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
 
 def read_dataframe(path: str):
     """ Reads in a file object to a pandas' frame.
@@ -31,6 +33,51 @@ def read_dataframe(path: str):
         raise Exception("Unknown filetype")
     return frame
 
+def read_excel_chunks(path: str, chunksize: int):
+    """ Reads the first sheet of an xlsx file in chunks of rows using
+    openpyxl's read-only mode so the workbook is never fully loaded.
+    Input:
+        path - a string path to the file
+        chunksize - number of rows per chunk
+    Output:
+        generator of pd.DataFrame
+    """
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunksize:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if len(chunk) != 0:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        wb.close()
+
+def read_dataframe_chunks(path: str, chunksize: int):
+    """ Reads a file in chunks of rows.
+    file is assumed to have a single header row.
+    Input:
+        path - a string path to the file
+        chunksize - number of rows per chunk
+    Output:
+        generator of pd.DataFrame
+    """
+    if path.endswith(".xlsx"):
+        return read_excel_chunks(path, chunksize)
+    elif path.endswith(".tsv"):
+        return pd.read_csv(path, sep='\t', chunksize=chunksize)
+    elif path.endswith(".csv"):
+        return pd.read_csv(path, chunksize=chunksize)
+    else:
+        raise Exception("Unknown filetype")
+
 def expand_field_by_delimiter(column: pd.Series, delim: str):
     """ Splits file rows by a ';' delimiter
     Input:
@@ -58,6 +105,40 @@ def remap_expanded_value(x, mapping: dict, delim: str):
     else:
         return mapping.get(x, None)
 
+def remap_expanded_column(column: pd.Series, mapping: dict, delim: str):
+    """ remaps a column the same way as applying remap_expanded_value to
+        every row of a column expanded with expand_field_by_delimiter, but
+        remaps all ids with vectorized operations. Cells holding several
+        ids are split in one pass over their concatenation and rejoined.
+    Input:
+        column - pandas series of ids
+        mapping - dictionary of sample/id remappings
+        delim - the delimiter to split and join values on
+    Output:
+        pd.Series - series with remapped ids combined by delimiter
+    """
+    keys = list(mapping.keys())
+    def lookup(ids: pd.Series):
+        # ids without a conversion become "None" like str(mapping.get(e, None))
+        return ids.map(mapping).astype(object).where(ids.isin(keys), None).astype(str)
+
+    ret = pd.Series(None, index=column.index, dtype=object)
+    contains = column.str.contains(delim, regex=False)
+    is_str = contains.notna().values
+    multi = (contains == True).values
+    single = is_str & ~multi
+
+    ret[single] = lookup(column[single]).values
+    if multi.any():
+        cells = column.values[multi].tolist()
+        ids = lookup(pd.Series(delim.join(cells).split(delim))).tolist()
+        ends = np.cumsum([x.count(delim) + 1 for x in cells]).tolist()
+        ret[multi] = [delim.join(ids[s:e]) for s, e in zip([0] + ends[:-1], ends)]
+
+    # values that are not strings cannot be split and are not remapped
+    ret[~is_str] = None
+    return ret
+
 def make_remapping(df: pd.DataFrame, from_col: str, to_col: str):
     """ creates dictionary for remapping ids from a dataframe and two column names
     Input:
@@ -77,8 +158,7 @@ def convert_dataframe_ids_in_rows(df: pd.DataFrame, mapping: dict, args: ap.Argu
         args - program arguments
     """
     for col in args.column:
-        df[col] = expand_field_by_delimiter(df[col], args.delim) \
-            .apply(lambda x: remap_expanded_value(x, mapping, args.delim))
+        df[col] = remap_expanded_column(df[col], mapping, args.delim)
 
 def convert_dataframe_ids_in_columns(df: pd.DataFrame, mapping: dict, args: ap.ArgumentParser):
     """ converts ids in dataframe column names based on args and id conversion mapping 
@@ -110,12 +190,13 @@ def convert_dataframe_ids_in_columns(df: pd.DataFrame, mapping: dict, args: ap.A
     df.columns = list(df.columns)[0:start_samples] + remap[start_samples::]
 
 
-def convert_dataframe_ids(data_df: pd.DataFrame, key_df: pd.DataFrame, args: ap.ArgumentParser):
-    """ converts ids in dataframe based on args and a dataframe containing id conversions
+def make_mapping(key_df: pd.DataFrame, args: ap.ArgumentParser):
+    """ creates dictionary for remapping ids from all column name pairs in args
     Input:
-        data_df - data pd.DataFrame with ids to be converted
         key_df - Key pd.DataFrame with id conversions
         args - program arguments
+    Output:
+        dict - dictionary of id conversions
     """
     mapping = dict()
     for pair in args.mapping.split(","):
@@ -125,7 +206,24 @@ def convert_dataframe_ids(data_df: pd.DataFrame, key_df: pd.DataFrame, args: ap.
         f = vals[0]
         t = vals[1]
         mapping.update(make_remapping(key_df, f, t))
+    return mapping
 
+def convert_dataframe_ids(data_df: pd.DataFrame, key_df: pd.DataFrame, args: ap.ArgumentParser):
+    """ converts ids in dataframe based on args and a dataframe containing id conversions
+    Input:
+        data_df - data pd.DataFrame with ids to be converted
+        key_df - Key pd.DataFrame with id conversions
+        args - program arguments
+    """
+    convert_dataframe_ids_with_mapping(data_df, make_mapping(key_df, args), args)
+
+def convert_dataframe_ids_with_mapping(data_df: pd.DataFrame, mapping: dict, args: ap.ArgumentParser):
+    """ converts ids in dataframe based on args and an id conversion mapping
+    Input:
+        data_df - data pd.DataFrame with ids to be converted
+        mapping - dictionary of id conversions
+        args - program arguments
+    """
     if args.column is None:
         convert_dataframe_ids_in_columns(data_df, mapping, args)
     else:
@@ -195,6 +293,51 @@ def convert_dataframe_ids(data_df: pd.DataFrame, key_df: pd.DataFrame, args: ap.
 
 #     return rawFile
 
+def convert_chunks(chunks, mapping: dict, args: ap.ArgumentParser):
+    """ converts ids in chunks of a data file. Column names are only
+        converted once, on the first chunk.
+    Input:
+        chunks - iterable of pd.DataFrame
+        mapping - dictionary of id conversions
+        args - program arguments
+    Output:
+        generator of converted pd.DataFrame
+    """
+    columns = None
+    for chunk in chunks:
+        if args.column is not None:
+            convert_dataframe_ids_in_rows(chunk, mapping, args)
+        elif columns is None:
+            convert_dataframe_ids_in_columns(chunk, mapping, args)
+            columns = list(chunk.columns)
+        else:
+            chunk.columns = columns
+        yield chunk
+
+def convert_file_in_chunks(args: ap.ArgumentParser):
+    """ converts ids in the data file a chunk of rows at a time and writes
+        each chunk to stdout as soon as it is converted
+    Input:
+        args - program arguments
+    """
+    mapping = make_mapping(pd.concat(read_dataframe_chunks(args.keyfile, args.chunksize)), args)
+    chunks = convert_chunks(read_dataframe_chunks(args.datafile, args.chunksize), mapping, args)
+    path = args.datafile
+    if path.endswith(".xlsx"):
+        from mucor.jsonlxlsx import write_xlsx
+        first = next(chunks, None)
+        if first is None:
+            return
+        def rows():
+            yield from first.itertuples(index=False, name=None)
+            for chunk in chunks:
+                yield from chunk.itertuples(index=False, name=None)
+        write_xlsx(list(first.columns), rows(), sys.stdout.buffer)
+    else:
+        sep = "\t" if path.endswith(".tsv") else ","
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(sys.stdout, index=False, sep=sep, header=(i == 0))
+
 def main():
     parser = ap.ArgumentParser()
     # Import the arguments from the user
@@ -203,8 +346,14 @@ def main():
     parser.add_argument("--column","-c", default=None, nargs="+", help="Name of column/s that the ids exist in the data file")
     parser.add_argument("--mapping","-m", required=True, help="Column name pairs in keyfile to create id conversion mapping from, e.g \"sample=accession\"")
     parser.add_argument("--delim","-d", default=";")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Process the data file this many rows at a time, for large files")
     args = parser.parse_args()
-    
+
+    if args.chunksize is not None:
+        convert_file_in_chunks(args)
+        return
+
     # Read files intp pandas dataframe
     data = read_dataframe(args.datafile)
     keys = read_dataframe(args.keyfile)
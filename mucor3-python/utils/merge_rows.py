@@ -1,5 +1,7 @@
-import numpy as np
-import pandas as pd
+from __future__ import annotations
+from mucor.lazy import lazy_import
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
 import argparse
 import sys
 